@@ -0,0 +1,153 @@
+import argparse
+import asyncio
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from .server import ServerOptions, start
+
+
+class ArgumentParser(argparse.ArgumentParser):
+    def __init__(self):
+        super().__init__('python -m bench', description='offline throughput benchmark against a local SoundCloud stand-in')
+        super().add_argument('--sizes', nargs='+', type=int, default=[200, 1000], help='collection sizes to benchmark')
+        super().add_argument('--latency', type=float, default=0.02, help='seconds added to every response')
+        super().add_argument('--bandwidth', type=float, default=0, help='bytes/sec per media response, 0 for unlimited')
+        super().add_argument('--throttle-rate', type=float, default=0, help='fraction of api requests answered with 429')
+        super().add_argument('--stub-rate', type=float, default=0, help='fraction of liked tracks listed without their media')
+        super().add_argument('--segments', type=int, default=6, help='hls segments per track')
+        super().add_argument('--segment-size', type=int, default=32 * 1024, help='bytes per hls segment')
+        super().add_argument('--protocol', choices=['hls', 'progressive'], default='hls', help='transcoding protocol to download')
+        super().add_argument(
+            '--collections', nargs='+', default=['track_likes'],
+            choices=['track_likes', 'likes', 'uploads', 'reposts', 'playlists'], help='collections listed in one pass')
+        super().add_argument('--page-size', type=int, default=200, help='collection page size')
+        super().add_argument('--max-workers', type=int, default=64, help='concurrent track downloads')
+        super().add_argument('--autotune-interval', type=float, default=5, help='seconds between concurrency adjustments, 0 to disable')
+        super().add_argument('--max-bandwidth', type=float, default=0, help='client bandwidth cap in bytes/sec, 0 for unlimited')
+        super().add_argument('--max-connections-per-host', type=int, default=0, help='client media connections per host')
+        super().add_argument('--rate', type=float, default=10, help='initial api requests per second')
+        super().add_argument('--streaming-parse', action='store_true', help='decode collection pages incrementally')
+        super().add_argument('--trace', help='directory receiving a chrome trace of the client per collection size')
+        super().add_argument('--json', action='store_true', help='print results as json')
+        super().add_argument('--client', help=argparse.SUPPRESS)
+
+
+async def run_client(base_url: str, size: int, args) -> dict:
+    """ Run the resolve/download pipeline against `base_url` in this process """
+    from scloud_dl import metrics
+    from scloud_dl.client import Client, Configurations
+    from scloud_dl.credentials import Credentials
+    from scloud_dl.downloader import TrackDownloader
+    from scloud_dl.scheduling import ORDERS, FairScheduler
+    from scloud_dl.store import TrackStore
+    from scloud_dl.tracing import TRACER
+
+    workdir = tempfile.mkdtemp(prefix='scloud_dl-bench-')
+    lane = f'bench-{size}'
+    config = Configurations(
+        profile_username=lane,
+        download_folder=workdir,
+        collection_types=args.collections,
+        base_url=base_url,
+        page_size=args.page_size,
+        streaming_parse=args.streaming_parse,
+        max_workers=args.max_workers,
+        autotune_interval=args.autotune_interval,
+        requests_per_second=args.rate,
+        max_bandwidth=args.max_bandwidth,
+        max_connections_per_host=args.max_connections_per_host,
+        cache_path=f'{workdir}/cache/tracks.db',
+        http_cache_path=f'{workdir}/cache/http',
+        artwork_cache=f'{workdir}/cache/artwork',
+        transcoding_preferences=[f'{args.protocol}:mp3_*'])
+    credentials = Credentials(oauth_token='bench', client_id='bench', user_id=size)
+    scheduler = FairScheduler([lane], maxsize=config.queue_size, key=ORDERS[config.download_order])
+    output = f'{workdir}/{lane}'
+
+    if args.trace:
+        TRACER.start(f'{args.trace}/bench-{size}.trace.json')
+    started = time.time()
+    async with Client(config) as client:
+        downloader = TrackDownloader(client, config, TrackStore(f'{workdir}/.store'))
+
+        async def resolve_tracks():
+            try:
+                user_id = await client.resolve_user_id(lane, credentials)
+                async for track in client.iter_tracks(credentials, user_id=user_id):
+                    await scheduler.put(lane, track)
+            finally:
+                await scheduler.close(lane)
+
+        await asyncio.gather(downloader.download_tracks(scheduler, {lane: output}), resolve_tracks())
+    elapsed = time.time() - started
+    TRACER.close()
+    result = {
+        'started': started,
+        'elapsed': elapsed,
+        'tracks': len([name for name in os.listdir(output) if name.endswith('.mp3')]),
+        'failures': sum(downloader.failures.values()),
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'metrics': metrics.REGISTRY.summary(),
+    }
+    shutil.rmtree(workdir)
+    return result
+
+
+async def run(args) -> 'list[dict]':
+    """ Serve the fake api from this process and benchmark each collection size in a fresh client process """
+    options = ServerOptions(
+        latency=args.latency, bandwidth=args.bandwidth, throttle_rate=args.throttle_rate, stub_rate=args.stub_rate,
+        segments=args.segments, segment_size=args.segment_size)
+    (server, runner, base_url) = await start(options)
+    client_args = [arg for arg in sys.argv[1:] if arg != '--json']
+    results = []
+    try:
+        for size in args.sizes:
+            server.requests.clear()
+            server.first_media_request = None
+            process = await asyncio.create_subprocess_exec(
+                sys.executable, '-m', 'bench', *client_args, '--sizes', str(size), '--client', base_url,
+                stdout=asyncio.subprocess.PIPE)
+            (stdout, _) = await process.communicate()
+            if process.returncode != 0:
+                raise RuntimeError(f'benchmark client failed for size {size}')
+            result = json.loads(stdout.decode().strip().splitlines()[-1])
+            results.append({
+                'size': size,
+                'tracks': result['tracks'],
+                'failures': result['failures'],
+                'elapsed_s': round(result['elapsed'], 3),
+                'tracks_per_s': round(result['tracks'] / result['elapsed'], 2),
+                'ttfb_s': round(server.first_media_request - result['started'], 3) if server.first_media_request else None,
+                'peak_rss_mb': round(result['peak_rss_kb'] / 1024, 1),
+                'requests': dict(server.requests),
+                'metrics': result['metrics'],
+            })
+    finally:
+        await runner.cleanup()
+    return results
+
+
+def report(results: 'list[dict]'):
+    print(f'{"size":>8} {"tracks":>8} {"fail":>5} {"elapsed s":>10} {"tracks/s":>9} {"ttfb s":>7} {"rss MB":>7}  requests')
+    for result in results:
+        requests = ' '.join(f'{kind}={count}' for (kind, count) in sorted(result['requests'].items()))
+        print(f'{result["size"]:>8} {result["tracks"]:>8} {result["failures"]:>5} {result["elapsed_s"]:>10} '
+              f'{result["tracks_per_s"]:>9} {result["ttfb_s"]!s:>7} {result["peak_rss_mb"]:>7}  {requests}')
+
+
+if __name__ == '__main__':
+    args = ArgumentParser().parse_args()
+    if args.client:
+        print(json.dumps(asyncio.run(run_client(args.client, args.sizes[0], args))))
+    else:
+        results = asyncio.run(run(args))
+        if args.json:
+            print(json.dumps(results, indent=2))
+        else:
+            report(results)
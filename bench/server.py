@@ -0,0 +1,246 @@
+import asyncio
+import copy
+import hashlib
+import json
+import random
+import time
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from aiohttp import web
+
+SAMPLE_PAGE = Path(__file__).parent.parent / 'misc' / 'collection.track_likes.response.json'
+
+
+@dataclass
+class ServerOptions:
+    latency: float = 0.02
+    bandwidth: float = 0
+    throttle_rate: float = 0
+    stub_rate: float = 0
+    retry_after: int = 1
+    segments: int = 6
+    segment_size: int = 32 * 1024
+    chunk_size: int = 16 * 1024
+
+
+class FakeSoundCloud:
+    """ Local stand-in for api-v2 paging, transcoding urls and the hls/progressive media cdn.
+        `/users/{n}/...` serves a collection of n likes, and `/resolve` maps `.../bench-{n}` to user id n.
+        A `stub_rate` fraction of the liked tracks comes without its media, to be fetched through `/tracks?ids=`.
+        Uploads, reposts and playlists of the same user overlap with the likes and with each other: uploads are
+        every 4th like, reposts the second half of the likes and n/4 more tracks, and n/20 playlists of 20 tracks
+        each share 10 with the next one and follow the reposts. `/likes` adds likes of those playlists to the
+        track likes """
+
+    def __init__(self, options: ServerOptions):
+        self._options = options
+        with open(SAMPLE_PAGE, 'r') as f:
+            self._sample = json.load(f)['collection']
+        self.requests: Counter = Counter()
+        self.first_media_request: float = None
+        self._cdn_connections = 0
+
+    def app(self) -> web.Application:
+        app = web.Application(middlewares=[self._shape])
+        app.router.add_get('/resolve', self._resolve)
+        app.router.add_get('/users/{user_id}/track_likes', self._track_likes)
+        app.router.add_get('/users/{user_id}/likes', self._likes)
+        app.router.add_get('/users/{user_id}/tracks', self._uploads)
+        app.router.add_get('/stream/users/{user_id}/reposts', self._reposts)
+        app.router.add_get('/users/{user_id}/playlists', self._playlists)
+        app.router.add_get('/playlists/{playlist_id}', self._get_playlist)
+        app.router.add_get('/tracks', self._tracks)
+        app.router.add_get('/media/{track_id}/{protocol}', self._transcoding)
+        app.router.add_get('/cdn/{track_id}/playlist.m3u8', self._playlist)
+        app.router.add_get('/cdn/{track_id}/segments/{segment}', self._segment)
+        app.router.add_get('/cdn/{track_id}/progressive', self._progressive)
+        app.router.add_get('/cdn/artwork/{name}', self._artwork)
+        return app
+
+    @web.middleware
+    async def _shape(self, request: web.Request, handler):
+        kind = request.path.split('/')[1]
+        self.requests[kind] += 1
+        if kind != 'cdn':
+            await asyncio.sleep(self._options.latency)
+            if random.random() < self._options.throttle_rate:
+                self.requests['429'] += 1
+                return web.Response(status=429, headers={'Retry-After': str(self._options.retry_after)})
+            return await handler(request)
+        if self.first_media_request is None:
+            self.first_media_request = time.time()
+        # a media request is in flight from its arrival until its body is sent, latency included
+        self._cdn_connections += 1
+        self.requests['peak_cdn'] = max(self.requests['peak_cdn'], self._cdn_connections)
+        try:
+            await asyncio.sleep(self._options.latency)
+            response = await handler(request)
+            if not response.prepared:
+                await response.prepare(request)
+                await response.write_eof()
+            return response
+        finally:
+            self._cdn_connections -= 1
+
+    def _base(self, request: web.Request) -> str:
+        return f'{request.scheme}://{request.host}'
+
+    def _cdn(self, request: web.Request) -> str:
+        # media is served under another host name so that it is not gated like api requests
+        return f'{request.scheme}://localhost:{request.url.port}'
+
+    async def _resolve(self, request: web.Request):
+        return web.json_response({'kind': 'user', 'id': int(request.query['url'].rsplit('-', 1)[-1])})
+
+    def _item(self, request: web.Request, index: int) -> dict:
+        item = copy.deepcopy(self._sample[index % len(self._sample)])
+        track_id = 10_000_000 + index
+        created_at = datetime(2022, 1, 1, tzinfo=timezone.utc) - timedelta(minutes=index)
+        item['created_at'] = created_at.strftime('%Y-%m-%dT%H:%M:%SZ')
+        item['track'].update(id=track_id, urn=f'soundcloud:tracks:{track_id}', title=f'bench track {index}')
+        for transcoding in item['track']['media']['transcodings']:
+            transcoding['url'] = f'{self._base(request)}/media/{track_id}/{transcoding["format"]["protocol"]}'
+            # every bench track streams in full, including those sampled from preview-only tracks
+            transcoding['snipped'] = False
+        # a few artworks and avatars shared by many tracks, as in real collections
+        item['track']['artwork_url'] = f'{self._cdn(request)}/cdn/artwork/track-{index % 16}-large.jpg' if index % 2 else None
+        item['track']['user']['avatar_url'] = f'{self._cdn(request)}/cdn/artwork/user-{index % 8}-large.jpg'
+        return item
+
+    def _listed(self, request: web.Request, index: int) -> dict:
+        item = self._item(request, index)
+        if random.Random(index).random() < self._options.stub_rate:
+            track = item['track']
+            item['track'] = {'kind': 'track', 'id': track['id'], 'urn': track['urn']}
+        return item
+
+    async def _tracks(self, request: web.Request):
+        track_ids = [int(track_id) for track_id in request.query['ids'].split(',')]
+        return web.json_response([self._item(request, track_id - 10_000_000)['track'] for track_id in track_ids])
+
+    def _playlist_item(self, request: web.Request, size: int, index: int, with_tracks: bool) -> dict:
+        playlist_id = 30_000_000 + size * 1000 + index
+        created_at = datetime(2021, 1, 1, tzinfo=timezone.utc) - timedelta(days=index)
+        playlist = {
+            'kind': 'playlist', 'id': playlist_id, 'urn': f'soundcloud:playlists:{playlist_id}',
+            'title': f'bench playlist {index}', 'created_at': created_at.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'last_modified': created_at.strftime('%Y-%m-%dT%H:%M:%SZ'), 'track_count': 20}
+        if with_tracks:
+            # like the api, the first tracks come complete and the rest as stubs
+            tracks = [self._item(request, size + size // 4 + index * 10 + offset)['track'] for offset in range(20)]
+            playlist['tracks'] = tracks[:5] + [
+                {'kind': 'track', 'id': track['id'], 'urn': track['urn']} for track in tracks[5:]]
+        return playlist
+
+    async def _get_playlist(self, request: web.Request):
+        playlist_id = int(request.match_info['playlist_id']) - 30_000_000
+        return web.json_response(self._playlist_item(request, playlist_id // 1000, playlist_id % 1000, True))
+
+    async def _playlists(self, request: web.Request):
+        size = int(request.match_info['user_id'])
+        # every other playlist is listed without its tracks
+        return self._page(request, size // 20, lambda index: self._playlist_item(request, size, index, index % 2 == 0))
+
+    async def _uploads(self, request: web.Request):
+        size = int(request.match_info['user_id'])
+
+        def upload(index: int) -> dict:
+            item = self._item(request, index * 4)
+            return {**item['track'], 'created_at': item['created_at']}
+        return self._page(request, (size + 3) // 4, upload)
+
+    async def _reposts(self, request: web.Request):
+        size = int(request.match_info['user_id'])
+
+        def repost(index: int) -> dict:
+            item = self._item(request, size // 2 + index)
+            return {'type': 'track-repost', 'created_at': item['created_at'], 'track': item['track']}
+        return self._page(request, size // 2 + size // 4, repost)
+
+    async def _likes(self, request: web.Request):
+        size = int(request.match_info['user_id'])
+
+        def like(index: int) -> dict:
+            if index < size:
+                return self._listed(request, index)
+            playlist = self._playlist_item(request, size, index - size, False)
+            return {'kind': 'like', 'created_at': playlist['created_at'], 'playlist': playlist}
+        return self._page(request, size + size // 20, like)
+
+    async def _track_likes(self, request: web.Request):
+        size = int(request.match_info['user_id'])
+        return self._page(request, size, lambda index: self._listed(request, index))
+
+    def _page(self, request: web.Request, size: int, item) -> web.Response:
+        """ Page of `size` items made by `item(index)`, with an ETag honoured on revalidation """
+        offset = int(request.query.get('offset', 0))
+        limit = int(request.query.get('limit', 50))
+        collection = [item(index) for index in range(offset, min(offset + limit, size))]
+        next_href = None
+        if offset + limit < size:
+            next_href = f'{self._base(request)}{request.path}?offset={offset + limit}&limit={limit}'
+        body = json.dumps({'collection': collection, 'next_href': next_href})
+        etag = f'"{hashlib.sha256(body.encode()).hexdigest()[:16]}"'
+        if request.headers.get('If-None-Match') == etag:
+            return web.Response(status=304, headers={'ETag': etag})
+        return web.Response(text=body, content_type='application/json', headers={'ETag': etag})
+
+    async def _transcoding(self, request: web.Request):
+        track_id = request.match_info['track_id']
+        expires = int(time.time()) + 3600
+        if request.match_info['protocol'] == 'hls':
+            return web.json_response({'url': f'{self._cdn(request)}/cdn/{track_id}/playlist.m3u8?Expires={expires}'})
+        return web.json_response({'url': f'{self._cdn(request)}/cdn/{track_id}/progressive?Expires={expires}'})
+
+    async def _playlist(self, request: web.Request):
+        lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:10']
+        for segment in range(self._options.segments):
+            lines += ['#EXTINF:10.0,', f'segments/{segment}']
+        lines.append('#EXT-X-ENDLIST')
+        return web.Response(text='\n'.join(lines), content_type='application/vnd.apple.mpegurl')
+
+    async def _send(self, request: web.Request, size: int, status: int = 200, headers: dict = None):
+        """ Stream `size` bytes, paced to the configured per-response bandwidth """
+        response = web.StreamResponse(status=status, headers=headers)
+        response.content_type = 'audio/mpeg'
+        response.content_length = size
+        await response.prepare(request)
+        chunk = b'\xff' * self._options.chunk_size
+        while size > 0:
+            payload = chunk[:size]
+            await response.write(payload)
+            size -= len(payload)
+            self.requests['bytes'] += len(payload)
+            if self._options.bandwidth:
+                await asyncio.sleep(len(payload) / self._options.bandwidth)
+        await response.write_eof()
+        return response
+
+    async def _artwork(self, request: web.Request):
+        self.requests['artwork'] += 1
+        return web.Response(body=b'\xff\xd8\xff\xe0' + b'\x00' * 16 * 1024, content_type='image/jpeg')
+
+    async def _segment(self, request: web.Request):
+        return await self._send(request, self._options.segment_size)
+
+    async def _progressive(self, request: web.Request):
+        size = self._options.segments * self._options.segment_size
+        if request.headers.get('Range', '').startswith('bytes='):
+            offset = int(request.headers['Range'][len('bytes='):].split('-')[0])
+            return await self._send(request, size - offset, status=206,
+                                    headers={'Content-Range': f'bytes {offset}-{size - 1}/{size}'})
+        return await self._send(request, size)
+
+
+async def start(options: ServerOptions, host: str = '127.0.0.1', port: int = 0):
+    """ Start the fake service, returning it with its runner and base url """
+    server = FakeSoundCloud(options)
+    runner = web.AppRunner(server.app())
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = runner.addresses[0][1]
+    return (server, runner, f'http://{host}:{port}')
@@ -0,0 +1,46 @@
+import argparse
+import re
+import subprocess
+import sys
+
+RGX_IMPORT_TIME = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)')
+
+
+def import_times(module: str) -> 'dict[str, int]':
+    """ Cumulative import time in microseconds of every module loaded by importing `module`, from -X importtime """
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True, check=True)
+    times = {}
+    for line in process.stderr.splitlines():
+        match = RGX_IMPORT_TIME.match(line)
+        if match:
+            times[match.group(4)] = int(match.group(2))
+    return times
+
+
+def check(module: str, budget_ms: float, runs: int) -> 'list[str]':
+    """ Violations of the cold-start budget, the best of `runs` imports being compared to `budget_ms`. Modules
+        that must stay lazy are checked by tests/test_startup.py """
+    samples = [import_times(module) for _ in range(runs)]
+    problems = []
+    best_ms = min(sample[module] for sample in samples) / 1000
+    print(f'{module} imports in {best_ms:.1f} ms (budget {budget_ms} ms)')
+    slowest = sorted(samples[0].items(), key=lambda item: -item[1])[:10]
+    for (name, micros) in slowest:
+        print(f'  {micros / 1000:8.1f} ms  {name}')
+    if best_ms > budget_ms:
+        problems.append(f'{module} took {best_ms:.1f} ms to import, over the {budget_ms} ms budget')
+    return problems
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('python -m bench.startup', description='cold-start import budget check')
+    parser.add_argument('--module', default='scloud_dl.__main__', help='module whose import is measured')
+    parser.add_argument('--budget-ms', type=float, default=400, help='maximum import time in milliseconds')
+    parser.add_argument('--runs', type=int, default=3, help='imports measured, the fastest one is compared')
+    args = parser.parse_args()
+    problems = check(args.module, args.budget_ms, args.runs)
+    for problem in problems:
+        print(f'FAIL: {problem}', file=sys.stderr)
+    sys.exit(1 if problems else 0)
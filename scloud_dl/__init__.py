@@ -1,12 +1,20 @@
 
 from dataclasses import dataclass
 import logging
+import os
 from logging import Logger
 
 @dataclass
 class Track:
     title: str
     url: str
+    protocol: str = 'hls'
+    mime_type: str = 'audio/mpeg'
+    id: int = None
+    # expected duration in milliseconds
+    duration: int = None
+    tags: dict = None
+    artwork_url: str = None
 
 def initLogging():
 
@@ -20,6 +28,7 @@ def initLogging():
     console_handler.setLevel(logging.INFO)
     console_handler.setFormatter(formatter)
 
+    os.makedirs('logs', exist_ok=True)
     file_handler = logging.FileHandler("logs/sc_dl.log")
     file_handler.setLevel(logging.DEBUG)
     file_handler.setFormatter(formatter)
@@ -1,43 +1,231 @@
 import asyncio
-from queue import Queue
 import argparse
+import logging
+import os
 
 from . import initLogging
-from .client import Client, Configurations
+from . import metrics
+from .client import COLLECTIONS, Client, Configurations
+from .transcodings import DEFAULT_PREFERENCES
 from .downloader import TrackDownloader
 from .credentials import Credentials
-from .selenium import SeleniumCredentialsProvider
+from .scheduling import ORDERS, FairScheduler
+from .shaping import parse_rate
+from .store import TrackStore
+from .journal import FailureJournal
+from .sync import SyncCursor, SyncWatermarks
+from .workqueue import WorkQueue
+from .tracing import TRACER
+from .auth import CredentialsManager
 from pathlib import Path
 
+logger = logging.getLogger(__name__)
+
 class ArgumentParser(argparse.ArgumentParser):
     def __init__(self):
         super().__init__('SoundCloud Downloader')
         super().add_argument('-d', '--download-folder',
                             help='sepecifies downloading directory', default='./SoundCloud Downloads')
-        super().add_argument('-l', '--likes', help='download profile likes', action='store_true')
-        super().add_argument('-p', '--profile-username', required=True,
-                            help='specifies profile username to target profile ex. https://soundcloud.com/\\{username\\}')
+        super().add_argument(
+            '-c', '--collections', nargs='+', action='extend', choices=list(COLLECTIONS), metavar='COLLECTION',
+            help=f'specifies collections listed in one pass among {", ".join(COLLECTIONS)}, their tracks downloaded '
+                 'once however many list them, defaults to track_likes')
+        super().add_argument(
+            '-l', '--likes', dest='collections', action='append_const', const='track_likes',
+            help='download profile likes')
+        super().add_argument('-p', '--profile-username', nargs='+', default=[],
+                            help='specifies profile usernames to target profiles ex. https://soundcloud.com/\\{username\\}')
+        super().add_argument('--profiles-file', help='specifies file listing profile usernames, one per line')
         super().add_argument(
             '--limit', help='specifies paging of track collections', default=200)
         super().add_argument('-f', '--first-page-only', help='download donload only first page', action='store_true')
+        super().add_argument(
+            '--page-prefetch', help='specifies number of collection pages fetched ahead of processing', type=int, default=4)
+        super().add_argument('--streaming-parse', help='decode collection pages incrementally as they arrive, requires ijson', action='store_true')
+        super().add_argument(
+            '--http-cache-size', type=int, default=256,
+            help='specifies megabytes of api responses kept to revalidate on the next run, 0 disables it, '
+                 'collection pages bypass it with --streaming-parse')
+        super().add_argument(
+            '--retry-failures', action='store_true',
+            help='only retry the tracks journaled as failed by earlier runs whose backoff has elapsed, without listing collections')
+        super().add_argument('--full-sync', help='ignore the last sync watermark and list the whole collection', action='store_true')
+        super().add_argument(
+            '-w', '--max-workers', help='specifies maximum number of tracks downloaded concurrently', type=int, default=64)
+        super().add_argument(
+            '--min-workers', help='specifies minimum number of tracks downloaded concurrently', type=int, default=4)
+        super().add_argument(
+            '--autotune-interval', type=float, default=5,
+            help='specifies seconds between download concurrency adjustments on measured throughput, 0 to always run --max-workers')
+        super().add_argument(
+            '--download-order', choices=list(ORDERS), default='longest',
+            help='specifies which buffered tracks are downloaded first by expected duration')
+        super().add_argument(
+            '--segment-window', help='specifies number of hls segments fetched concurrently per track', type=int, default=4)
+        super().add_argument(
+            '--max-bandwidth', type=parse_rate, default=0,
+            help='caps media transfers to this many bytes/sec shared by every track, ex. 512K or 4M, 0 for unlimited')
+        super().add_argument(
+            '--bandwidth-schedule',
+            help='file of "HH:MM rate" lines setting the bandwidth cap by time of day, read again when it changes '
+                 'or on SIGHUP')
+        super().add_argument(
+            '--max-connections-per-host', type=int, default=0,
+            help='specifies maximum number of media connections open to one host, 0 for unlimited')
+        super().add_argument(
+            '--queue-size', help='specifies number of resolved tracks buffered ahead of the downloaders', type=int, default=128)
+        super().add_argument(
+            '--rate', help='specifies initial api requests per second, adapted to throttling at runtime', type=float, default=10)
+        super().add_argument(
+            '--max-in-flight', help='specifies maximum number of concurrent api requests', type=int, default=16)
+        super().add_argument(
+            '--transcoding-preference', nargs='+', default=DEFAULT_PREFERENCES,
+            help='specifies transcodings in order of preference as protocol:preset patterns ex. progressive:mp3_standard hls:opus_*')
+        super().add_argument(
+            '--output-mode', choices=['copy', 'encode'], default='copy',
+            help='copy keeps the source codec without decoding, encode re-encodes to --output-format when codecs differ')
+        super().add_argument(
+            '--no-tags', dest='tagging', action='store_false',
+            help='skips writing id3 tags and cover art from the track metadata')
+        super().add_argument('--output-format', help='specifies target codec for encode output mode', default='mp3')
+        super().add_argument(
+            '--work-queue', help='specifies sqlite work queue shared with other processes or nodes through a common filesystem')
+        super().add_argument(
+            '--role', choices=['all', 'coordinator', 'worker'], default='all',
+            help='with --work-queue, coordinator lists and resolves tracks into the queue, worker downloads queued tracks')
+        super().add_argument(
+            '--lease-seconds', type=float, default=120,
+            help='specifies how long a worker holds a queued track without a heartbeat before it is handed out again')
+        super().add_argument('--metrics-port', type=int, help='serves prometheus metrics on http://127.0.0.1:{port}/metrics')
+        super().add_argument('--metrics-json', help='writes a json summary of the run metrics to this file')
+        super().add_argument(
+            '--trace', help='records a timeline of every track stage to this file in Chrome trace-event format, '
+                            'to open in https://ui.perfetto.dev')
+        super().add_argument(
+            '--encode-workers', help='specifies number of ffmpeg processes remuxing or encoding in parallel', type=int, default=os.cpu_count())
+
+
+async def sync_profile(sc_client: Client, credentials: Credentials, scheduler: FairScheduler,
+                       cursors: 'dict[str, SyncCursor]', profile_username: str, journal: FailureJournal = None,
+                       retry_failures: bool = False) -> 'dict[str, SyncCursor]':
+    def on_failure(track_id: int, stage: str, error: BaseException):
+        if journal:
+            journal.record(profile_username, track_id, stage, error)
 
+    try:
+        if retry_failures:
+            track_ids = journal.due(profile_username)
+            logger.info(f'retrying {len(track_ids)} failed tracks of {profile_username}')
+            tracks = sc_client.iter_tracks(credentials, track_ids=track_ids, on_failure=on_failure)
+        else:
+            user_id = await sc_client.resolve_user_id(profile_username, credentials)
+            tracks = sc_client.iter_tracks(credentials, cursors, user_id=user_id, on_failure=on_failure)
+        async for track in tracks:
+            await scheduler.put(profile_username, track)
+    finally:
+        await scheduler.close(profile_username)
+    return cursors
 
-async def main(config: Configurations):
-    provider = SeleniumCredentialsProvider()
 
-    
-    credentials: Credentials = await provider.credentials(config.profile_username)
+class ProfilePaths(dict):
+    """ View directory of each profile, including profiles only known from work queue jobs """
+
+    def __init__(self, root: str, profile_usernames: 'list[str]'):
+        super().__init__({profile_username: f'{root}/{profile_username}' for profile_username in profile_usernames})
+        self._root = root
+
+    def __missing__(self, profile_username: str) -> str:
+        return f'{self._root}/{profile_username}'
+
+
+async def main(config: Configurations, profile_usernames: 'list[str]'):
+    syncing = config.role != 'worker'
+    downloading = config.role != 'coordinator'
+    watermarks = SyncWatermarks()
+    cursors = {
+        profile_username: {
+            collection_type: watermarks.cursor(profile_username, collection_type, full_sync=config.full_sync)
+            for collection_type in config.collection_types}
+        for profile_username in profile_usernames}
+    # workers on other nodes journal their failures in the work queue, where the coordinator retries them
+    journal = FailureJournal(config.work_queue) if config.work_queue else FailureJournal()
+    paths = ProfilePaths(f'{Path.home()}/{config.download_folder}', profile_usernames)
+    if config.work_queue:
+        scheduler = WorkQueue(
+            config.work_queue, lanes=profile_usernames if syncing else (), maxsize=config.queue_size,
+            key=ORDERS[config.download_order], lease_seconds=config.lease_seconds)
+    else:
+        scheduler = FairScheduler(
+            profile_usernames, maxsize=max(1, config.queue_size // len(profile_usernames)), key=ORDERS[config.download_order])
+
+    metrics_runner = await metrics.REGISTRY.serve(config.metrics_port) if config.metrics_port else None
+    if config.trace_path:
+        TRACER.start(config.trace_path)
 
     sc_client: Client
-    qtracks = Queue()
-    async with Client(config) as sc_client:
-        tracks = await sc_client.get_tracks(credentials)
-        
-    for track in tracks:
-        qtracks.put(track)
+    heartbeat = asyncio.create_task(scheduler.heartbeat()) if config.work_queue and downloading else None
+    try:
+        async with Client(config) as sc_client:
+            sc_client.track_store = TrackStore(f'{Path.home()}/{config.download_folder}/.store')
+            downloader = TrackDownloader(sc_client, config, sc_client.track_store, journal)
+            syncs = []
+            if syncing:
+                sc_client.credentials_manager = CredentialsManager(sc_client, config.base_url)
+                credentials: Credentials = await sc_client.credentials_manager.credentials(config.profile_username)
+                syncs = [sync_profile(sc_client, credentials, scheduler, cursors[profile_username], profile_username,
+                                      journal, retry_failures=config.retry_failures)
+                         for profile_username in profile_usernames]
+            sync_tasks = [asyncio.create_task(sync) for sync in syncs]
+            download = asyncio.create_task(
+                downloader.download_tracks(scheduler, paths) if downloading else asyncio.sleep(0))
+
+            def on_downloaded(task: asyncio.Task):
+                # once nothing downloads, syncs would wait forever for room in the scheduler
+                if not task.cancelled() and task.exception():
+                    for sync_task in sync_tasks:
+                        sync_task.cancel()
+
+            download.add_done_callback(on_downloaded)
+            results = await asyncio.gather(download, *sync_tasks, return_exceptions=True)
+    finally:
+        if heartbeat:
+            heartbeat.cancel()
+        if config.work_queue:
+            scheduler.close_connection()
+        if config.metrics_json:
+            metrics.REGISTRY.write_summary(config.metrics_json)
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        TRACER.close()
+
+    if isinstance(results[0], Exception):
+        raise results[0]
+    for (profile_username, result) in zip(profile_usernames, results[1:]):
+        if isinstance(result, Exception):
+            logger.error(f'failed to sync {profile_username}', exc_info=result)
+            continue
+        if downloader.failures[profile_username]:
+            # journaled failures are retried with --retry-failures rather than by listing the collection again
+            logger.warning(f'{downloader.failures[profile_username]} tracks of {profile_username} failed, run with --retry-failures to retry them')
+        if config.first_page_only or config.retry_failures:
+            continue
+        for (collection_type, cursor) in cursors[profile_username].items():
+            if not cursor.complete:
+                logger.warning(f'{collection_type} of {profile_username} were not fully listed, keeping their previous watermark')
+                continue
+            if cursor.newest:
+                watermarks.set(profile_username, collection_type, cursor.newest)
+    watermarks.close()
+    journal.close()
+
 
-    downloader = TrackDownloader(max_workers=config.max_workers)
-    await downloader.download_tracks(qtracks, f'{Path.home()}/{config.download_folder}/{config.profile_username}')
+def read_profiles(profile_usernames: 'list[str]', profiles_file: str) -> 'list[str]':
+    """ Usernames from the command line followed by those listed one per line in `profiles_file`, without duplicates """
+    profiles = list(profile_usernames or [])
+    if profiles_file:
+        with open(profiles_file, 'r') as f:
+            profiles += [line.strip() for line in f if line.strip() and not line.startswith('#')]
+    return list(dict.fromkeys(profiles))
 
 if __name__ == '__main__':
     parser = ArgumentParser()
@@ -45,14 +233,44 @@ if __name__ == '__main__':
     initLogging()
 
     args = parser.parse_args()
-    if args.likes:
-        download_folder = f'{args.download_folder}/likes'
+    profile_usernames = read_profiles(args.profile_username, args.profiles_file)
+    if args.role != 'all' and not args.work_queue:
+        parser.error(f'--role {args.role} requires --work-queue')
+    if not profile_usernames and args.role != 'worker':
+        parser.error('at least one of --profile-username or --profiles-file is required')
     config = Configurations(
         download_folder=args.download_folder,
-        collection_type='track_likes',
-        profile_username=args.profile_username,
+        collection_types=list(dict.fromkeys(args.collections or ['track_likes'])),
+        profile_username=profile_usernames[0] if profile_usernames else None,
         page_size=args.limit,
-        first_page_only= args.first_page_only
+        first_page_only= args.first_page_only,
+        full_sync=args.full_sync,
+        retry_failures=args.retry_failures,
+        page_prefetch=args.page_prefetch,
+        streaming_parse=args.streaming_parse,
+        http_cache_size=args.http_cache_size * 1024 * 1024,
+        max_workers=args.max_workers,
+        min_workers=args.min_workers,
+        autotune_interval=args.autotune_interval,
+        download_order=args.download_order,
+        segment_window=args.segment_window,
+        max_bandwidth=args.max_bandwidth,
+        bandwidth_schedule=args.bandwidth_schedule,
+        max_connections_per_host=args.max_connections_per_host,
+        queue_size=args.queue_size,
+        requests_per_second=args.rate,
+        max_in_flight=args.max_in_flight,
+        transcoding_preferences=args.transcoding_preference,
+        output_mode=args.output_mode,
+        output_format=args.output_format,
+        tagging=args.tagging,
+        encode_workers=args.encode_workers,
+        work_queue=args.work_queue,
+        role=args.role,
+        lease_seconds=args.lease_seconds,
+        metrics_port=args.metrics_port,
+        metrics_json=args.metrics_json,
+        trace_path=args.trace
     )
 
-    asyncio.run(main(config=config))
+    asyncio.run(main(config=config, profile_usernames=profile_usernames))
@@ -0,0 +1,53 @@
+import asyncio
+import hashlib
+import logging
+import os
+from logging import Logger
+from typing import Optional
+
+from aiohttp_retry import RetryClient
+
+from .shaping import MEDIA_TIMEOUT, TransferShaper
+
+logger: Logger = logging.getLogger(__name__)
+
+
+class ArtworkCache:
+    """ Artwork files on disk keyed by url, fetched once however many tracks share them, ex. an uploader
+        avatar standing in for missing track artwork """
+
+    def __init__(self, session: RetryClient, root: str = './cache/artwork', shaper: TransferShaper = None):
+        self._session = session
+        self._root = root
+        self._shaper = shaper or TransferShaper()
+        self._fetching: 'dict[str, asyncio.Future]' = {}
+
+    def path(self, url: str) -> str:
+        digest = hashlib.sha256(url.encode()).hexdigest()
+        return f'{self._root}/{digest[:2]}/{digest}{os.path.splitext(url.split("?")[0])[1]}'
+
+    async def _fetch(self, url: str, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        async with self._shaper.connection(url), self._session.get(
+                url, raise_for_status=True, timeout=MEDIA_TIMEOUT) as resp:
+            data = await resp.read()
+        await self._shaper.consume(len(data))
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    async def get(self, url: str) -> Optional[str]:
+        """ Path of the artwork at `url`, or None when it cannot be fetched """
+        path = self.path(url)
+        if os.path.exists(path):
+            return path
+        if url not in self._fetching:
+            self._fetching[url] = asyncio.ensure_future(self._fetch(url, path))
+            self._fetching[url].add_done_callback(lambda _: self._fetching.pop(url, None))
+        try:
+            await asyncio.shield(self._fetching[url])
+        except Exception:
+            logger.warning(f'failed to fetch artwork {url}', exc_info=1)
+            return None
+        return path
@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import re
+from logging import Logger
+from typing import Callable, Optional
+
+from aiohttp_retry import RetryClient
+
+from .credentials import Credentials, CredentialsProviderBase
+
+logger: Logger = logging.getLogger(__name__)
+
+
+class ClientIdScraper:
+    """ Reads the public client_id out of the javascript bundles loaded by the soundcloud web app """
+
+    RGX_SCRIPT: str = r'<script[^>]+src="(https://[^"]+sndcdn\.com/assets/[^"]+\.js)"'
+    RGX_CLIENT_ID: str = r'client_id\s*[:=]\s*"?(\w{32})'
+
+    def __init__(self, session: RetryClient, web_url: str = 'https://soundcloud.com'):
+        self._session = session
+        self._web_url = web_url
+
+    async def _text(self, url: str) -> str:
+        async with self._session.get(url, raise_for_status=True) as resp:
+            return await resp.text()
+
+    async def client_id(self) -> Optional[str]:
+        scripts = re.findall(self.RGX_SCRIPT, await self._text(self._web_url))
+        # the bundle holding the api configuration is among the last ones loaded
+        for script in reversed(scripts):
+            client_id_search = re.search(self.RGX_CLIENT_ID, await self._text(script))
+            if client_id_search:
+                return client_id_search.group(1)
+        return None
+
+
+def browser_provider() -> CredentialsProviderBase:
+    from .selenium import SeleniumCredentialsProvider
+    return SeleniumCredentialsProvider()
+
+
+class CredentialsManager:
+    """ Credential lifecycle: cached credentials are validated with one api call, a rejected client_id is
+        scraped again from the web app, and the browser flow only runs when nothing else works. Credentials
+        are refreshed in place so that every holder of the object sees the new values on its next request """
+
+    def __init__(self, session: RetryClient, base_url: str, credentials_file: str = './cache/credentials.json',
+                 fallback: Callable[[], CredentialsProviderBase] = browser_provider):
+        self._session = session
+        self._base_url = base_url
+        self._credentials_file = credentials_file
+        self._fallback = fallback
+        self._scraper = ClientIdScraper(session)
+        self._lock = asyncio.Lock()
+        self._credentials: Credentials = None
+        self._profile_username: str = None
+        self._generation: int = 0
+
+    @property
+    def generation(self) -> int:
+        """ Incremented on every refresh, used by callers to tell whether their failure predates it """
+        return self._generation
+
+    async def validate(self, credentials: Credentials) -> bool:
+        async with self._session.get(
+                f'{self._base_url}/me',
+                params={'client_id': f'{credentials.client_id}'},
+                headers={'Authorization': f'OAuth {credentials.oauth_token}', 'Accept': 'application/json'}) as resp:
+            if resp.status in (401, 403):
+                logger.warning(f'credentials rejected with {resp.status}')
+                return False
+            return resp.status < 400
+
+    async def _from_browser(self, profile_username: str) -> Credentials:
+        logger.info('falling back to browser login for credentials')
+        return await self._fallback().credentials(profile_username, use_cache=False)
+
+    async def _scrape_client_id(self, credentials: Credentials) -> bool:
+        try:
+            client_id = await self._scraper.client_id()
+        except Exception:
+            logger.warning('failed to scrape client_id', exc_info=1)
+            return False
+        if not client_id or client_id == credentials.client_id:
+            return False
+        logger.info('scraped a new client_id from the web app')
+        credentials.update(None, client_id, None)
+        return await self.validate(credentials)
+
+    async def credentials(self, profile_username: str) -> Credentials:
+        """ Valid credentials, from the cache when they still work """
+        credentials = Credentials.load_credentials(self._credentials_file)
+        if credentials is None or not credentials.is_valid:
+            credentials = await self._from_browser(profile_username)
+        elif not await self.validate(credentials) and not await self._scrape_client_id(credentials):
+            fresh = await self._from_browser(profile_username)
+            credentials.update(fresh.oauth_token, fresh.client_id, fresh.user_id)
+        credentials.save_credentials(self._credentials_file)
+        self._credentials = credentials
+        self._profile_username = profile_username
+        return credentials
+
+    async def refresh(self, generation: int):
+        """ Refresh credentials rejected mid-run, unless another request already did since `generation` """
+        async with self._lock:
+            if generation != self._generation:
+                return
+            credentials = self._credentials
+            if await self.validate(credentials):
+                # rejected for another reason than the credentials, ex. a track blocked in this region
+                return
+            if not await self._scrape_client_id(credentials):
+                fresh = await self._from_browser(self._profile_username)
+                credentials.update(fresh.oauth_token, fresh.client_id, fresh.user_id)
+            credentials.save_credentials(self._credentials_file)
+            self._generation += 1
@@ -0,0 +1,85 @@
+import asyncio
+import logging
+import time
+from logging import Logger
+from typing import Callable
+
+from . import metrics
+
+logger: Logger = logging.getLogger(__name__)
+
+
+class ConcurrencyTuner:
+    """ Limit on concurrent downloads adjusted by hill climbing on the measured download throughput: every
+        `interval` seconds the limit keeps moving in the direction that raised throughput, turns back when it
+        fell, and steps down on a plateau where extra workers no longer help. A failure rate above
+        `max_error_rate` halves it. An `interval` of 0 keeps the limit fixed at `maximum` """
+
+    def __init__(self, minimum: int, maximum: int, interval: float = 5, tolerance: float = 0.05,
+                 max_error_rate: float = 0.1):
+        self._minimum = max(1, min(minimum, maximum))
+        self._maximum = maximum
+        self._interval = interval
+        self._tolerance = tolerance
+        self._max_error_rate = max_error_rate
+        self.limit: int = maximum if not interval else max(self._minimum, maximum // 4)
+        self._active = 0
+        self._peak = 0
+        self._direction = 1
+        self._throughput: float = None
+        self._changed = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._changed:
+            await self._changed.wait_for(lambda: self._active < self.limit)
+            self._active += 1
+            self._peak = max(self._peak, self._active)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        async with self._changed:
+            self._active -= 1
+            self._changed.notify()
+
+    @staticmethod
+    def _totals() -> 'tuple[float, float, float]':
+        return (metrics.BYTES_DOWNLOADED.total(), metrics.TRACKS_DOWNLOADED.total(), metrics.DOWNLOAD_FAILURES.total())
+
+    def _step(self, throughput: float, error_rate: float, saturated: bool) -> int:
+        step = max(1, self.limit // 4)
+        if error_rate > self._max_error_rate:
+            self._direction = 1
+            return max(self._minimum, self.limit // 2)
+        if not saturated:
+            # workers were waiting for tracks, throughput says nothing about the limit
+            return self.limit
+        if self._throughput is not None:
+            if throughput < self._throughput * (1 - self._tolerance):
+                self._direction = -self._direction
+            elif throughput <= self._throughput * (1 + self._tolerance):
+                self._direction = -1
+        return min(self._maximum, max(self._minimum, self.limit + self._direction * step))
+
+    async def run(self, backlog: Callable[[], int]):
+        """ Adjust the limit until cancelled, `backlog` telling how many tracks are waiting for a worker """
+        if not self._interval:
+            return
+        (downloaded, completed, failed) = self._totals()
+        started = time.monotonic()
+        while True:
+            await asyncio.sleep(self._interval)
+            (now, totals) = (time.monotonic(), self._totals())
+            throughput = (totals[0] - downloaded) / (now - started)
+            finished = (totals[1] - completed) + (totals[2] - failed)
+            error_rate = (totals[2] - failed) / finished if finished else 0
+            limit = self._step(throughput, error_rate, self._peak >= self.limit and backlog() > 0)
+            if limit != self.limit:
+                logger.info(f'download workers {self.limit} -> {limit} at {throughput / 1024:.0f} KiB/s, '
+                            f'{error_rate:.0%} failures')
+            self._throughput = throughput
+            async with self._changed:
+                self.limit = limit
+                self._peak = self._active
+                self._changed.notify_all()
+            (downloaded, completed, failed) = totals
+            started = now
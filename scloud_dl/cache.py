@@ -0,0 +1,95 @@
+import base64
+import json
+import logging
+import os
+import sqlite3
+import time
+from logging import Logger
+from typing import Optional
+from urllib.parse import urlparse, parse_qs
+
+from . import Track
+
+logger: Logger = logging.getLogger(__name__)
+
+
+def url_expiry(url: str) -> Optional[float]:
+    """ Expiry timestamp embedded in a signed url, either as an `Expires` param or a CloudFront `Policy` """
+    params = parse_qs(urlparse(url).query)
+    for name in ('Expires', 'expires'):
+        if params.get(name) and params[name][0].isdigit():
+            return float(params[name][0])
+    if params.get('Policy'):
+        try:
+            policy = params['Policy'][0].replace('-', '+').replace('_', '=').replace('~', '/')
+            statement = json.loads(base64.b64decode(policy))['Statement'][0]
+            return float(statement['Condition']['DateLessThan']['AWS:EpochTime'])
+        except (ValueError, KeyError, IndexError, TypeError):
+            logger.debug(f'unreadable policy in {url}')
+    return None
+
+
+class TrackCache:
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS tracks (
+            id INTEGER PRIMARY KEY,
+            urn TEXT,
+            title TEXT NOT NULL,
+            transcoding_url TEXT NOT NULL,
+            url TEXT NOT NULL,
+            protocol TEXT NOT NULL,
+            mime_type TEXT NOT NULL,
+            resolved_at REAL NOT NULL,
+            expires_at REAL NOT NULL
+        )"""
+
+    def __init__(self, db_path: str = './cache/tracks.db', ttl: float = 3600, batch_size: int = 100, safety_margin: float = 300):
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._connection = sqlite3.connect(db_path)
+        self._connection.execute(self.SCHEMA)
+        self._connection.commit()
+        self._ttl = ttl
+        self._batch_size = batch_size
+        self._safety_margin = safety_margin
+        # rows waiting for the next flush, by track id
+        self._pending: dict = {}
+
+    def get(self, track_id: int, transcoding_url: str) -> Optional[Track]:
+        """ Cached track resolved from the same transcoding whose url is not about to expire """
+        pending = self._pending.get(track_id)
+        if pending and pending[3] == transcoding_url and pending[8] > time.time() + self._safety_margin:
+            row = (pending[2], *pending[4:7])
+        else:
+            row = self._connection.execute(
+                'SELECT title, url, protocol, mime_type FROM tracks WHERE id = ? AND transcoding_url = ? AND expires_at > ?',
+                (track_id, transcoding_url, time.time() + self._safety_margin)).fetchone()
+        if row is None:
+            return None
+        (title, url, protocol, mime_type) = row
+        return Track(title=title, url=url, protocol=protocol, mime_type=mime_type, id=track_id)
+
+    def expired(self, url: str) -> bool:
+        """ Whether the signed `url` expires within the safety margin """
+        expires_at = url_expiry(url)
+        return expires_at is not None and expires_at <= time.time() + self._safety_margin
+
+    def put(self, track: Track, urn: str, transcoding_url: str):
+        resolved_at = time.time()
+        expires_at = url_expiry(track.url) or resolved_at + self._ttl
+        self._pending[track.id] = (
+            track.id, urn, track.title, transcoding_url, track.url, track.protocol, track.mime_type, resolved_at, expires_at)
+        if len(self._pending) >= self._batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        with self._connection:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO tracks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', self._pending.values())
+        logger.debug(f'cached {len(self._pending)} tracks')
+        self._pending.clear()
+
+    def close(self):
+        self.flush()
+        self._connection.close()
@@ -0,0 +1,50 @@
+import json
+import logging
+import os
+from logging import Logger
+
+logger: Logger = logging.getLogger(__name__)
+
+
+class Checkpoint:
+    """ Sidecar of a `.part` file recording the bytes and hls segments of it known to be on disk, and the size
+        of the tag header written ahead of the media bytes """
+
+    def __init__(self, part_path: str, source: str):
+        self._path = f'{part_path}.json'
+        self._part_path = part_path
+        self._source = source
+        self.segments: int = 0
+        self.offset: int = 0
+        self.header: int = 0
+
+    def load(self) -> 'Checkpoint':
+        """ Restore progress and truncate the part file to it, starting over if it belongs to another source """
+        if os.path.exists(self._path) and os.path.exists(self._part_path):
+            try:
+                with open(self._path, 'r') as f:
+                    state = json.load(f)
+                if state['source'] == self._source and os.path.getsize(self._part_path) >= state['offset']:
+                    self.segments = state['segments']
+                    self.offset = state['offset']
+                    self.header = state.get('header', 0)
+            except (ValueError, KeyError):
+                logger.warning(f'discarding unreadable checkpoint {self._path}')
+        if os.path.exists(self._part_path):
+            os.truncate(self._part_path, self.offset)
+        if self.offset:
+            logger.info(f'resuming {self._part_path} from byte {self.offset} (segment {self.segments})')
+        return self
+
+    def save(self, segments: int, offset: int, header: int = None):
+        self.segments = segments
+        self.offset = offset
+        self.header = self.header if header is None else header
+        tmp_path = f'{self._path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'source': self._source, 'segments': segments, 'offset': offset, 'header': self.header}, f)
+        os.replace(tmp_path, self._path)
+
+    def remove(self):
+        if os.path.exists(self._path):
+            os.remove(self._path)
@@ -1,122 +1,464 @@
 
 from aiohttp_retry import RetryClient, ExponentialRetry
+import json
 import logging
-import requests
+from aiohttp import ClientResponseError
 from logging import Logger
 import asyncio
 from . import Track
+from .auth import CredentialsManager
 from .credentials import Credentials
-from typing import Set
-from dataclasses import dataclass, field
-import random
-import aiofiles
+from .store import TrackStore
+from .tagging import cover_url, track_tags
+from .transcodings import DEFAULT_PREFERENCES, extension_of, output_codec, select_transcoding
+from typing import Callable, List, Optional, Set, Tuple
+from dataclasses import dataclass, field, replace
+from urllib.parse import urlparse
 import os
-import csv
-from aiocsv.writers import AsyncDictWriter
-from aiocsv.readers import AsyncReader
+import time
+from .cache import TrackCache
+from .httpcache import HttpCache, cache_key
+from .ratelimit import AdaptiveRateLimiter
+from . import metrics, models
+from .paging import Pager
+from .sync import SyncCursor
+from .tracing import TRACER, current_track
 
 
 logger: Logger = logging.getLogger(__name__)
 
+# api path of each collection of a profile
+COLLECTIONS: dict = {
+    'track_likes': '/users/{user_id}/track_likes',
+    'likes': '/users/{user_id}/likes',
+    'uploads': '/users/{user_id}/tracks',
+    'reposts': '/stream/users/{user_id}/reposts',
+    'playlists': '/users/{user_id}/playlists',
+}
+# collections not listed newest first, where an incremental sync skips the items not updated since the watermark
+# rather than stopping at the first one
+UNORDERED_COLLECTIONS: set = {'playlists'}
+
 
 @dataclass
 class Configurations:
     profile_username: str
     download_folder: str
-    collection_type: str
+    collection_types: List[str]
 
     retry_attempts: int = 4
     retry_start_timeout: float = 3
-    retry_statuses: Set[int] = field(default_factory=lambda: set([403, 429]))
+    retry_statuses: Set[int] = field(default_factory=lambda: set([429]))
     base_url: str = "https://api-v2.soundcloud.com"
     first_page_only: bool = False
     page_size: int = 500
-    max_workers: int = 6
+    streaming_parse: bool = False
+    hydrate_batch_size: int = 50
+    max_workers: int = 64
+    min_workers: int = 4
+    autotune_interval: float = 5
+    download_order: str = 'longest'
+    segment_window: int = 4
+    max_bandwidth: float = 0
+    bandwidth_schedule: str = None
+    max_connections_per_host: int = 0
+    resolve_workers: int = 16
+    page_prefetch: int = 4
+    queue_size: int = 128
+    cache_path: str = './cache/tracks.db'
+    cache_ttl: float = 3600
+    http_cache_path: str = './cache/http'
+    http_cache_size: int = 256 * 1024 * 1024
+    full_sync: bool = False
+    retry_failures: bool = False
+    requests_per_second: float = 10
+    max_requests_per_second: float = 50
+    max_in_flight: int = 16
+    transcoding_preferences: List[str] = field(default_factory=lambda: list(DEFAULT_PREFERENCES))
+    output_mode: str = 'copy'
+    output_format: str = 'mp3'
+    encode_workers: int = field(default_factory=os.cpu_count)
+    encode_queue_size: int = 64
+    tagging: bool = True
+    artwork_cache: str = './cache/artwork'
+    work_queue: str = None
+    role: str = 'all'
+    lease_seconds: float = 120
+    metrics_port: int = None
+    metrics_json: str = None
+    trace_path: str = None
 
 class Client(RetryClient):
     def __init__(self, config: Configurations):
+        self._rate_limiter = AdaptiveRateLimiter(
+            rate=config.requests_per_second,
+            max_rate=config.max_requests_per_second,
+            max_in_flight=config.max_in_flight)
+        api_hosts = [urlparse(config.base_url).hostname]
+        # installed first when tracing, so that request spans contain the rate limiter wait
+        trace_configs = [TRACER.trace_config()] if TRACER.enabled else []
         super().__init__(
             raise_for_status=False,
+            trace_configs=trace_configs + [
+                self._rate_limiter.trace_config(api_hosts),
+                metrics.trace_config(api_hosts, config.retry_statuses, config.retry_attempts)],
             retry_options=ExponentialRetry(
                 attempts=config.retry_attempts,
                 start_timeout=config.retry_start_timeout,
                 statuses=config.retry_statuses
             ))
-        self._cached_tracks: dict = {}
-        if os.path.exists('./cache/tracks.tsv'):
-            with open('./cache/tracks.tsv', 'r') as tracks_cache:
-                reader = csv.DictReader(tracks_cache, fieldnames=["title", "url"], delimiter='\t')
-                for row in reader:
-                    self._cached_tracks[row['title']] = row['url']
+        self._cache = TrackCache(config.cache_path, ttl=config.cache_ttl)
+        self._http_cache = HttpCache(config.http_cache_path, config.http_cache_size) if config.http_cache_size else None
 
         self._config: Configurations = config
+        self.credentials_manager: CredentialsManager = None
+        self.track_store: TrackStore = None
+        self._resolving: dict = {}
+
+    async def close(self):
+        self._cache.close()
+        if self._http_cache:
+            self._http_cache.close()
+        await super().close()
 
     def _headers(self, credentials: Credentials):
         return {
-            'Autherization': f'OAuth {credentials.oauth_token}',
+            'Authorization': f'OAuth {credentials.oauth_token}',
             'Accept': 'application/json'
         }
-    
-    async def _get_collection(self, target, credentials: Credentials):
-
-        resp = await self.get(
-            url=target,
-            headers=self._headers(credentials),
-            params={
-                'client_id': f'{credentials.client_id}',
-                'limit': f'{self._config.page_size}',
-                'linked_partitioning': 'true'
-            })
-        await asyncio.sleep(1)
-        json_payload = await resp.json()
-        return (json_payload['collection'], json_payload['next_href'])
-
-    async def _from_json(self, json_track, credentials: Credentials) -> Track:
-        track_title = json_track['title']
-        if self._cached_tracks.get(track_title):
-            logger.info(f'retrieving data for track: {track_title} from cache')
-            return Track(title= track_title, url= self._cached_tracks[track_title])
-        if len(json_track['media']['transcodings']) > 0:
-            logger.info(f'retrieving data for {track_title} from soundcloud api')
-            resp = await self.get(
-                url=json_track['media']['transcodings'][0]['url'],
-                params={'client_id': f'{credentials.client_id}'},
-                headers=self._headers(credentials)
-            )
-            if resp.content_type == 'application/json':
-                json_payload = await resp.json()
-                track = Track(title=track_title, url=json_payload['url'])
-                if json_payload.get('url'):
-                    async with aiofiles.open('./cache/tracks.tsv', mode='a') as tracks_cache:
-                        writer = AsyncDictWriter(tracks_cache, delimiter='\t', fieldnames=["title","url"])
-                        await writer.writerow(track.__dict__)
-                    return Track(title=json_track['title'], url=json_payload['url'])
+
+    def _api_request(self, url: str, credentials: Credentials, params: dict = None, headers: dict = None):
+        return self.get(
+            url=url,
+            headers={**self._headers(credentials), **(headers or {})},
+            params={'client_id': f'{credentials.client_id}', **(params or {})})
+
+    async def _api_get(self, url: str, credentials: Credentials, params: dict = None, headers: dict = None):
+        """ GET an api url with the current credentials, refreshing them once if they are rejected """
+        generation = self.credentials_manager.generation if self.credentials_manager else None
+        resp = await self._api_request(url, credentials, params, headers)
+        if resp.status in (401, 403) and self.credentials_manager:
+            resp.release()
+            logger.warning(f'credentials rejected with {resp.status} on {url}, refreshing')
+            await self.credentials_manager.refresh(generation)
+            resp = await self._api_request(url, credentials, params, headers)
+        return resp
+
+    async def _api_get_cached(self, url: str, credentials: Credentials, params: dict = None,
+                              revalidate: bool = True) -> Tuple[str, Optional[bytes], bool]:
+        """ GET an api url revalidating the response cached by a previous run, unless `revalidate` is False.
+            Returns the cache key, the body or None when the api answered 304 Not Modified, and whether the body
+            changed since it was cached """
+        key = cache_key(url, params)
+        cached = self._http_cache.get(key) if revalidate else None
+        resp = await self._api_get(url, credentials, params, headers=cached.validators() if cached else None)
+        if resp.status == 304 and cached:
+            resp.release()
+            self._http_cache.touch(key)
+            metrics.HTTP_CACHE.inc(result='not_modified')
+            return (key, None, False)
+        resp.raise_for_status()
+        body = await resp.read()
+        changed = self._http_cache.put(key, body, resp.headers)
+        metrics.HTTP_CACHE.inc(result='changed' if changed else 'unchanged')
+        return (key, body, changed)
+
+    async def _get_collection(self, target, credentials: Credentials, since: str = None):
+        params = {
+            'limit': f'{self._config.page_size}',
+            'linked_partitioning': 'true'
+        }
+        with metrics.PAGE_SECONDS.time(), TRACER.span('page', 'listing', url=target):
+            if self._http_cache is None or self._config.streaming_parse:
+                resp = await self._api_get(target, credentials, params)
+                if self._config.streaming_parse:
+                    page = await models.Page.stream(resp.content)
+                else:
+                    page = models.Page.decode(await resp.json())
+            else:
+                (key, body, changed) = await self._api_get_cached(target, credentials, params)
+                newest = None if changed else self._http_cache.get(key).meta.get('newest')
+                if since and newest and newest <= since:
+                    # the same page as when the watermark was taken, none of its items is new
+                    logger.info(f'collection page unchanged since {since}')
+                    return ([], None)
+                page = models.Page.decode(json.loads(body if body is not None else self._http_cache.body(key)))
+                if changed and page.collection:
+                    self._http_cache.set_meta(key, {'newest': page.collection[0].created_at})
+        metrics.PAGES.inc()
+        return (page.collection, page.next_href)
+
+    async def _from_model(self, sc_track: models.Track, credentials: Credentials) -> Track:
+        current_track.set(sc_track.id)
+        with TRACER.span('resolve', 'resolve', title=sc_track.title):
+            return await self._resolve_model(sc_track, credentials)
+
+    async def _resolve_model(self, sc_track: models.Track, credentials: Credentials) -> Track:
+        track_title = sc_track.title
+        transcoding = select_transcoding(sc_track.media.transcodings, self._config.transcoding_preferences) if sc_track.media else None
+        if transcoding:
+            mime_type = transcoding.format.mime_type
+            duration = transcoding.duration or sc_track.full_duration or sc_track.duration
+            extension = extension_of(output_codec(mime_type, self._config.output_mode, self._config.output_format))
+            if self.track_store and self.track_store.has(sc_track.id, extension):
+                logger.info(f'{track_title} is already stored')
+                metrics.TRACKS_RESOLVED.inc(source='store')
+                return Track(
+                    title=track_title, url=None, protocol=transcoding.format.protocol, mime_type=mime_type,
+                    id=sc_track.id, duration=duration)
+            cached_track = self._cache.get(sc_track.id, transcoding.url)
+            if cached_track:
+                logger.info(f'retrieving data for track: {track_title} from cache')
+                metrics.TRACKS_RESOLVED.inc(source='cache')
+                return replace(cached_track, **self._details(sc_track, duration))
+            # profiles sharing a track wait on a single resolution
+            key = (sc_track.id, transcoding.url)
+            resolving = self._resolving.get(key)
+            if resolving is None:
+                # named after the resolving task, so that its requests show on the same row of a trace
+                resolving = asyncio.create_task(
+                    self._resolve(sc_track, transcoding, credentials), name=asyncio.current_task().get_name())
+                self._resolving[key] = resolving
+                resolving.add_done_callback(lambda _: self._resolving.pop(key, None))
+            track = await asyncio.shield(resolving)
+            return replace(track, **self._details(sc_track, duration)) if track else None
         return None
 
-    async def get_tracks(self, credentials: Credentials):
-        """ Retrieve collection of tracks from api, based on collection_type """
-        target = f"/users/{credentials.user_id}/{self._config.collection_type}"
-        tasks = set()
-        next_href = f'{self._config.base_url}{target}'
-        logger.info(f'get collection url: {next_href}')
-        async def _populate_tasks(href):
-            (liked_collection, next_href) = await self._get_collection(href, credentials)
+    def _details(self, sc_track: models.Track, duration: int) -> dict:
+        """ Fields of a resolved track that depend on the listing it comes from rather than on its stream """
+        details = {'title': sc_track.title, 'duration': duration}
+        if self._config.tagging:
+            details.update(tags=track_tags(sc_track), artwork_url=cover_url(sc_track))
+        return details
+
+    async def _resolve(self, sc_track: models.Track, transcoding: models.Transcoding, credentials: Credentials) -> Track:
+        track_title = sc_track.title
+        logger.info(f'retrieving data for {track_title} from soundcloud api ({transcoding.format.protocol}:{transcoding.preset})')
+        started = time.monotonic()
+        json_payload = await self._get_stream_payload(transcoding.url, credentials)
+        if json_payload:
+            if json_payload.get('url'):
+                track = Track(
+                    title=track_title,
+                    url=json_payload['url'],
+                    protocol=transcoding.format.protocol,
+                    mime_type=transcoding.format.mime_type,
+                    id=sc_track.id)
+                self._cache.put(track, sc_track.urn, transcoding.url)
+                metrics.RESOLVE_SECONDS.observe(time.monotonic() - started, source='api')
+                metrics.TRACKS_RESOLVED.inc(source='api')
+                return track
+        return None
+
+    async def _get_stream_payload(self, url: str, credentials: Credentials) -> dict:
+        """ Stream payload of a transcoding, raising on http errors and on bodies that are not json """
+        if self._http_cache is None:
+            resp = await self._api_get(url, credentials)
+            resp.raise_for_status()
+            return await resp.json()
+        (key, body, _) = await self._api_get_cached(url, credentials)
+        if body is not None:
+            return json.loads(body)
+        payload = json.loads(self._http_cache.body(key))
+        if payload.get('url') and self._cache.expired(payload['url']):
+            # not modified, but the stream url signed when it was cached is no longer usable
+            logger.info(f'cached stream url of {url} expired, fetching it again')
+            (_, body, _) = await self._api_get_cached(url, credentials, revalidate=False)
+            payload = json.loads(body)
+        return payload
+
+    async def resolve_user_id(self, profile_username: str, credentials: Credentials) -> int:
+        """ Resolve a profile username to its user id """
+        resp = await self._api_get(
+            f'{self._config.base_url}/resolve',
+            credentials,
+            params={'url': f'https://soundcloud.com/{profile_username}'})
+        resp.raise_for_status()
+        json_payload = await resp.json()
+        return json_payload['id']
+
+    async def _iter_collection(self, credentials: Credentials, collection_type: str, cursor: SyncCursor,
+                               user_id: int = None):
+        """ Yield listed tracks page by page, prefetching up to `page_prefetch` pages ahead, expanding playlists
+            into their tracks and stopping at the first item already covered by the previous sync """
+        ordered = collection_type not in UNORDERED_COLLECTIONS
+        target = COLLECTIONS[collection_type].format(user_id=user_id or credentials.user_id)
+        href = f'{self._config.base_url}{target}'
+        logger.info(f'get collection url: {href}')
+        prefetch = 0 if self._config.first_page_only else self._config.page_prefetch
+        since = cursor.since if ordered else None
+        pager = Pager(lambda next_href: self._get_collection(next_href, credentials, since), prefetch=prefetch)
+        async for liked_collection in pager.pages(href):
             for item in liked_collection:
-                json_track = item['track']
-                task = asyncio.create_task(self._from_json(json_track, credentials))
-                tasks.add(task)
-                await asyncio.sleep(random.uniform(0.05, 0.12))
-            return next_href
-        try:
+                # unordered playlists are listed again when they change, however long ago they were created
+                updated_at = item.playlist.last_modified if item.playlist and not ordered else None
+                if not cursor.is_new(updated_at or item.created_at):
+                    if ordered:
+                        logger.info(f'reached {collection_type} synced before {cursor.since}')
+                        return
+                    continue
+                if item.track:
+                    yield item.track
+                elif item.playlist:
+                    try:
+                        playlist_tracks = await self._playlist_tracks(item.playlist, credentials)
+                    except (ClientResponseError, ValueError):
+                        logger.error(f'failed to list the tracks of playlist {item.playlist.title}', exc_info=1)
+                        cursor.complete = False
+                        continue
+                    for sc_track in playlist_tracks:
+                        yield sc_track
             if self._config.first_page_only:
-                await _populate_tasks(next_href)
+                break
+
+    async def _iter_collections(self, credentials: Credentials, cursors: 'dict[str, SyncCursor]', user_id: int = None):
+        """ Yield the tracks of each collection in turn, each track only the first time it is listed """
+        seen = set()
+        for (collection_type, cursor) in cursors.items():
+            async for sc_track in self._iter_collection(credentials, collection_type, cursor, user_id):
+                if sc_track.id in seen:
+                    metrics.TRACKS_DEDUPLICATED.inc()
+                    continue
+                seen.add(sc_track.id)
+                yield sc_track
+
+    async def _playlist_tracks(self, playlist: models.Playlist, credentials: Credentials) -> 'List[models.Track]':
+        """ Tracks of `playlist`, fetching them when the listing left them out. Most are stubs, hydrated in
+            batches along with the other incomplete tracks """
+        if playlist.tracks is not None:
+            return playlist.tracks
+        url = f'{self._config.base_url}/playlists/{playlist.id}'
+        with TRACER.span('playlist', 'listing', playlist_id=playlist.id):
+            if self._http_cache is None:
+                resp = await self._api_get(url, credentials)
+                resp.raise_for_status()
+                payload = await resp.json()
             else:
-                while next_href is not None:
-                    next_href = await _populate_tasks(next_href)
+                (key, body, _) = await self._api_get_cached(url, credentials)
+                payload = json.loads(body if body is not None else self._http_cache.body(key))
+        return models.Playlist.decode(payload).tracks or []
+
+    async def _get_tracks_by_id(self, track_ids: 'List[int]', credentials: Credentials) -> 'List[models.Track]':
+        with TRACER.span('hydrate', 'listing', tracks=len(track_ids)):
+            resp = await self._api_get(
+                f'{self._config.base_url}/tracks',
+                credentials,
+                params={'ids': ','.join(str(track_id) for track_id in track_ids)})
+            resp.raise_for_status()
+            sc_tracks = [models.Track.decode(json_track) for json_track in await resp.json()]
+        metrics.TRACKS_HYDRATED.inc(len(sc_tracks))
+        return sc_tracks
+
+    async def _iter_ids(self, track_ids: 'List[int]'):
+        for track_id in track_ids:
+            yield models.Track(track_id)
+
+    async def _hydrate(self, sc_tracks, credentials: Credentials, on_failure: Callable):
+        """ Pass complete tracks through and fetch the incomplete ones, missing their title or transcodings,
+            in `/tracks?ids=` batches of up to `hydrate_batch_size` while the collection is still being paged """
+        stubs = []
+        batches = {}
+
+        def _request():
+            logger.debug(f'hydrating {len(stubs)} tracks')
+            batches[asyncio.create_task(self._get_tracks_by_id(stubs, credentials))] = stubs
+
+        def _completed():
+            for task in [task for task in batches if task.done()]:
+                track_ids = batches.pop(task)
+                if task.exception():
+                    metrics.RESOLVE_FAILURES.inc(len(track_ids))
+                    logger.error(f'failed to hydrate tracks {track_ids}', exc_info=task.exception())
+                    for track_id in track_ids:
+                        on_failure(track_id, 'hydrate', task.exception())
+                    continue
+                missing = set(track_ids) - {sc_track.id for sc_track in task.result()}
+                if missing:
+                    metrics.RESOLVE_FAILURES.inc(len(missing))
+                    logger.warning(f'tracks {sorted(missing)} are no longer available')
+                    for track_id in missing:
+                        on_failure(track_id, 'hydrate', LookupError('track is no longer available'))
+                yield from task.result()
+
+        try:
+            async for sc_track in sc_tracks:
+                if sc_track.is_complete:
+                    yield sc_track
+                else:
+                    stubs.append(sc_track.id)
+                    if len(stubs) >= self._config.hydrate_batch_size:
+                        _request()
+                        stubs = []
+                for hydrated in _completed():
+                    yield hydrated
+            if stubs:
+                _request()
+            while batches:
+                await asyncio.wait(batches, return_when=asyncio.FIRST_COMPLETED)
+                for hydrated in _completed():
+                    yield hydrated
+        finally:
+            for task in batches:
+                task.cancel()
+
+    async def iter_tracks(self, credentials: Credentials, cursors: 'dict[str, SyncCursor]' = None, user_id: int = None,
+                          track_ids: 'List[int]' = None, on_failure: Callable = None):
+        """ Yield tracks as soon as their stream urls resolve, with at most `resolve_workers` resolutions in flight.
+            Tracks come from listing the collections of `cursors`, every one of `collection_types` by default, or
+            from `track_ids` when given, and `on_failure` is called with the id, stage and error of every track
+            that could not be resolved """
+        on_failure = on_failure or (lambda track_id, stage, error: None)
+        pending = set()
+        track_of: 'dict[asyncio.Task, int]' = {}
+        # slots of the resolutions in flight, naming their tasks so that a trace shows one row per slot
+        free_slots = list(range(self._config.resolve_workers, 0, -1))
+
+        def _completed(done):
+            for task in done:
+                track_id = track_of.pop(task)
+                free_slots.append(int(task.get_name().rsplit('-', 1)[1]))
+                if task.exception():
+                    metrics.RESOLVE_FAILURES.inc()
+                    logger.error('failed to resolve track', exc_info=task.exception())
+                    on_failure(track_id, 'resolve', task.exception())
+                elif task.result():
+                    yield task.result()
+                else:
+                    metrics.RESOLVE_FAILURES.inc()
+                    on_failure(track_id, 'resolve', LookupError('no playable transcoding or stream url'))
+
+        if track_ids is not None:
+            sc_tracks = self._iter_ids(track_ids)
+        else:
+            cursors = cursors or {collection_type: SyncCursor() for collection_type in self._config.collection_types}
+            sc_tracks = self._iter_collections(credentials, cursors, user_id)
+        try:
+            async for sc_track in self._hydrate(sc_tracks, credentials, on_failure):
+                task = asyncio.create_task(self._from_model(sc_track, credentials), name=f'resolve-{free_slots.pop()}')
+                track_of[task] = sc_track.id
+                pending.add(task)
+                if len(pending) >= self._config.resolve_workers:
+                    (done, pending) = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for track in _completed(done):
+                        yield track
+            while pending:
+                (done, pending) = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for track in _completed(done):
+                    yield track
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def get_tracks(self, credentials: Credentials):
+        """ Retrieve collection of tracks from api, based on collection_types """
+        tracks = []
+        try:
+            async for track in self.iter_tracks(credentials):
+                tracks.append(track)
         except TypeError:
             logger.error('problem', exc_info=2)
-        except requests.exceptions.RetryError as ex:
+        except ClientResponseError as ex:
             logger.error(
-                'Problem with Auth, max retries exceeded!', exc_info=1)
+                f'Problem with api, {ex.status} after retries!', exc_info=1)
             raise ex
-        return await asyncio.gather(*tasks)
\ No newline at end of file
+        return tracks
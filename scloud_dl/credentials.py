@@ -41,7 +41,7 @@ class CredentialsProviderBase:
     def __init__(self):
         self._credentials: Credentials
      
-    def credentials(self, user_name):
+    def credentials(self, user_name, use_cache: bool = True):
         pass
         
 
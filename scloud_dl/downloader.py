@@ -1,41 +1,237 @@
-from concurrent.futures import ThreadPoolExecutor
-import ffmpeg
+import asyncio
 import os
 import logging
-from queue import Queue
+from collections import Counter
 from logging import Logger
+from urllib.parse import urlparse
+
+import aiofiles
+from aiohttp_retry import RetryClient
+
 from . import Track
+from . import metrics
+from .autotune import ConcurrencyTuner
+from .artwork import ArtworkCache
+from .checkpoint import Checkpoint
+from .encoder import EncodeJob, EncoderPool
+from .hls import HLSDownloader
+from .journal import FailureJournal
+from .scheduling import FairScheduler
+from .shaping import MEDIA_TIMEOUT, TransferShaper
+from .store import TrackStore
+from .tagging import id3_tag, image_mime_type
+from .tracing import TRACER, current_track
+from .transcodings import codec_of, extension_of, output_codec
 
 logger: Logger = logging.getLogger(__name__)
 
 class TrackDownloader:
-    def __init__(self, max_workers: int):
-        self._max_workers = max_workers
-
-    async def download_tracks(self, qtracks: "Queue[Track]", path: str):
-        def download_track(track: Track):
-            if not os.path.exists(f"{path}/{track.title.replace('/','')}.mp3") and track:
-                logger.info(f'downloading {track.title} into {path}')
-                (
-                    ffmpeg
-                    .input(track.url)
-                    .output(f"{path}/{track.title.replace('/','')}.mp3")
-                    .overwrite_output()
-                    .run(quiet= True)
-                )
+    CHUNK_SIZE: int = 64 * 1024
+    CHECKPOINT_BYTES: int = 1024 * 1024
+    LOCK_POLL_SECONDS: float = 1
+    # codecs whose concatenated stream is already a playable file
+    RAW_CODECS: set = {'mp3'}
+
+    def __init__(self, session: RetryClient, config, store: TrackStore, journal: FailureJournal = None):
+        self._session = session
+        self._store = store
+        self._journal = journal
+        self._in_flight: 'dict[str, asyncio.Future]' = {}
+        self._config = config
+        self._max_workers = config.max_workers
+        self._tuner = ConcurrencyTuner(config.min_workers, config.max_workers, interval=config.autotune_interval)
+        self._shaper = TransferShaper(config.max_bandwidth, config.max_connections_per_host)
+        self._hls = HLSDownloader(session, window=config.segment_window, shaper=self._shaper)
+        self.failures: Counter = Counter()
+        self._tagging = config.tagging
+        self._artwork = ArtworkCache(session, config.artwork_cache, self._shaper)
+        self._encoder = EncoderPool(config.encode_workers, config.encode_queue_size, self.failures, journal)
+
+    async def _download_progressive(self, url: str, output, checkpoint: Checkpoint):
+        resume_at = checkpoint.offset - checkpoint.header
+        headers = {'Range': f'bytes={resume_at}-'} if resume_at else {}
+        flow = self._shaper.flow()
+        async with self._shaper.connection(url), self._session.get(
+                url, headers=headers, raise_for_status=True, timeout=MEDIA_TIMEOUT) as resp:
+            offset = checkpoint.offset
+            if resume_at and resp.status != 206:
+                logger.info(f'range requests unsupported for {url}, restarting download')
+                await output.truncate(checkpoint.header)
+                offset = checkpoint.header
+            unsaved = 0
+            async for chunk in resp.content.iter_chunked(self.CHUNK_SIZE):
+                await self._shaper.consume(len(chunk), flow)
+                await output.write(chunk)
+                metrics.BYTES_DOWNLOADED.inc(len(chunk))
+                offset += len(chunk)
+                unsaved += len(chunk)
+                if unsaved >= self.CHECKPOINT_BYTES:
+                    await output.flush()
+                    checkpoint.save(0, offset)
+                    unsaved = 0
+
+    @staticmethod
+    def _source_of(track: Track) -> str:
+        """ What a `.part` file is downloaded from. The path of the stream url names the transcoding preset,
+            while its query holds a signature that changes every time the track is resolved """
+        return f'{track.protocol}:{track.mime_type}:{urlparse(track.url).path}'
+
+    async def _download_stream(self, track: Track, file_path: str, header: bytes = b''):
+        """ Download into a checkpointed `.part` file starting with `header`, renamed to `file_path` only once complete """
+        part_path = f'{file_path}.part'
+        checkpoint = Checkpoint(part_path, self._source_of(track)).load()
+        with TRACER.span('fetch', 'download', protocol=track.protocol, resumed_at=checkpoint.offset):
+            await self._fetch_stream(track, part_path, checkpoint, header)
+        os.replace(part_path, file_path)
+        checkpoint.remove()
+
+    async def _fetch_stream(self, track: Track, part_path: str, checkpoint: Checkpoint, header: bytes):
+        async with aiofiles.open(part_path, 'ab') as output:
+            if header and not checkpoint.offset:
+                await output.write(header)
+                await output.flush()
+                checkpoint.save(0, len(header), header=len(header))
+            if track.protocol == 'hls':
+                async def on_segment(segment, size):
+                    metrics.BYTES_DOWNLOADED.inc(size)
+                    await output.flush()
+                    checkpoint.save(checkpoint.segments + 1, checkpoint.offset + size)
+                await self._hls.download(track.url, output, start=checkpoint.segments, on_segment=on_segment)
             else:
-                logger.warning(f'file {path} already exist')
+                await self._download_progressive(track.url, output, checkpoint)
+
+    @staticmethod
+    def _read_artwork(artwork_path: str) -> tuple:
+        if artwork_path is None:
+            return (None,)
+        with open(artwork_path, 'rb') as f:
+            return (f.read(), image_mime_type(artwork_path))
+
+    async def _download_object(self, track: Track, object_path: str, lane: str, on_done):
+        source_codec = codec_of(track.mime_type)
+        target_codec = output_codec(track.mime_type, self._config.output_mode, self._config.output_format)
+        self._store.prepare(object_path)
+        artwork_path = None
+        if self._tagging and track.artwork_url:
+            with TRACER.span('artwork', 'download'):
+                artwork_path = await self._artwork.get(track.artwork_url)
+        if source_codec == target_codec and source_codec in self.RAW_CODECS:
+            header = b''
+            if self._tagging:
+                # tags go in the same pass, ahead of the first mpeg frame
+                header = id3_tag(track.tags or {}, *self._read_artwork(artwork_path))
+            with metrics.DOWNLOAD_SECONDS.time(protocol=track.protocol):
+                await self._download_stream(track, object_path, header)
+            metrics.TRACKS_DOWNLOADED.inc(protocol=track.protocol)
+            on_done(True)
+            return
+        source_path = f'{object_path}.{source_codec}.src'
+        if not os.path.exists(source_path):
+            with metrics.DOWNLOAD_SECONDS.time(protocol=track.protocol):
+                await self._download_stream(track, source_path)
+            metrics.TRACKS_DOWNLOADED.inc(protocol=track.protocol)
+        await self._encoder.submit(EncodeJob(
+            lane, track.title, source_path, object_path, copy=source_codec == target_codec, on_done=on_done,
+            tags=(track.tags or {}) if self._tagging else None, artwork_path=artwork_path, track_id=track.id))
+
+    def _link(self, object_path: str, path: str, track: Track, lane: str):
+        self._store.link(object_path, path, track.title, track.id)
+        if self._journal and lane:
+            self._journal.resolved(lane, track.id)
+
+    async def _lock(self, object_path: str, track: Track) -> int:
+        """ Wait until no other process stores `object_path` and lock it """
+        lock = self._store.try_lock(object_path)
+        if lock is None:
+            logger.info(f'waiting for {track.title} to be stored by another process')
+        while lock is None:
+            await asyncio.sleep(self.LOCK_POLL_SECONDS)
+            lock = self._store.try_lock(object_path)
+        return lock
+
+    async def download_track(self, track: Track, path: str, lane: str = None):
+        """ Make `track` available in `path`, downloading it into the store only when no profile has it yet.
+            Returns True when it was already stored, else a future resolved once storing it succeeded or failed """
+        if track is None:
+            return
+        extension = extension_of(output_codec(track.mime_type, self._config.output_mode, self._config.output_format))
+        object_path = self._store.object_path(track.id, extension)
+        if object_path in self._in_flight:
+            logger.info(f'waiting for {track.title} to be stored by another profile')
+            if not await self._in_flight[object_path]:
+                raise RuntimeError(f'storing {track.title} failed in another profile')
+        if os.path.exists(object_path):
+            self._link(object_path, path, track, lane)
+            return True
+        stored = asyncio.get_running_loop().create_future()
+        self._in_flight[object_path] = stored
+        lock = None
+
+        def on_done(success: bool):
+            del self._in_flight[object_path]
+            self._store.unlock(lock)
+            stored.set_result(success)
+            if success:
+                self._link(object_path, path, track, lane)
 
         try:
+            lock = await self._lock(object_path, track)
+            # stored by another process while waiting for the lock, or already in `path` from before the store
+            if os.path.exists(object_path) or self._store.adopt(object_path, path, track.title, track.duration):
+                on_done(True)
+                return True
+            logger.info(f'downloading {track.title} into {path}')
+            await self._download_object(track, object_path, lane, on_done)
+        except BaseException:
+            if not stored.done():
+                on_done(False)
+            raise
+        return stored
+
+    async def download_tracks(self, scheduler: FairScheduler, paths: 'dict[str, str]'):
+        """ Download tracks handed out by `scheduler` into `paths[lane]` with up to `max_workers` workers shared by
+            every lane, as many running at once as the tuner allows, handing sources that need remuxing or
+            encoding over to the encoder pool """
+        async def worker(index: int):
+            asyncio.current_task().set_name(f'download-{index}')
+            while True:
+                # a track is only taken off the scheduler once it can start, so that it keeps ordering the rest
+                async with self._tuner:
+                    with TRACER.span('idle', 'download'):
+                        scheduled = await scheduler.get()
+                    if scheduled is None:
+                        return
+                    (lane, track) = scheduled
+                    current_track.set(track.id)
+                    try:
+                        with TRACER.span('download', 'download', title=track.title, lane=lane):
+                            stored = await self.download_track(track, paths[lane], lane)
+                    except Exception as ex:
+                        stored = False
+                        self.failures[lane] += 1
+                        metrics.DOWNLOAD_FAILURES.inc()
+                        logger.error(f'failed to download {track.title}', exc_info=1)
+                        if self._journal:
+                            self._journal.record(lane, track.id, 'download', ex)
+                    scheduler.task_done(scheduled, stored)
+
+        metrics.DOWNLOAD_QUEUE.source = scheduler.qsize
+        metrics.DOWNLOAD_WORKERS.source = lambda: self._tuner.limit
+        metrics.BANDWIDTH_LIMIT.source = lambda: self._shaper.rate
+        for path in paths.values():
             if not os.path.exists(path):
                 os.makedirs(path)
-            with ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="ffmpeg-download") as pool:
-
-                while not qtracks.empty():
-                    track = qtracks.get(timeout=1.0)
 
-                    pool.submit(download_track, track)
-                    qtracks.task_done()
+        async def download():
+            tuning = asyncio.create_task(self._tuner.run(scheduler.qsize))
+            shaping = asyncio.create_task(
+                self._shaper.follow_schedule(self._config.bandwidth_schedule)) if self._config.bandwidth_schedule else None
+            try:
+                await asyncio.gather(*(worker(index) for index in range(self._max_workers)))
+            finally:
+                tuning.cancel()
+                if shaping:
+                    shaping.cancel()
+                await self._encoder.close()
 
-        except ffmpeg.Error as err:
-            logger.error('ffmpeg Error', exc_info=1)
+        await asyncio.gather(download(), self._encoder.run())
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from logging import Logger
+from typing import Callable
+
+from . import metrics
+from .journal import FailureJournal
+from .tracing import TRACER, current_track
+
+logger: Logger = logging.getLogger(__name__)
+
+# containers ffmpeg embeds a cover picture into
+ARTWORK_CONTAINERS: set = {'.mp3', '.m4a'}
+
+
+@dataclass
+class EncodeJob:
+    lane: str
+    title: str
+    source_path: str
+    file_path: str
+    copy: bool
+    # called in the event loop with whether the job succeeded
+    on_done: Callable[[bool], None] = None
+    tags: dict = None
+    artwork_path: str = None
+    track_id: int = None
+
+
+def convert(source_path: str, file_path: str, copy: bool, tags: dict = None, artwork_path: str = None):
+    """ Remux (`copy`) or re-encode `source_path` into `file_path` through a temporary file renamed into place,
+        writing `tags` and the cover at `artwork_path` in the same pass """
+    import ffmpeg
+
+    output_options = {'c:a': 'copy'} if copy else {}
+    (root, extension) = os.path.splitext(file_path)
+    part_path = f'{root}.part{extension}'
+    streams = [ffmpeg.input(source_path).audio]
+    for (index, (name, value)) in enumerate((tags or {}).items()):
+        output_options[f'metadata:g:{index}'] = f'{name}={value}'
+    if artwork_path and extension in ARTWORK_CONTAINERS:
+        streams.append(ffmpeg.input(artwork_path).video)
+        output_options.update({'c:v': 'copy', 'disposition:v': 'attached_pic'})
+    try:
+        (
+            ffmpeg
+            .output(*streams, part_path, **output_options)
+            .overwrite_output()
+            .run(quiet= True)
+        )
+    except ffmpeg.Error as err:
+        # a source ffmpeg cannot read is fetched again on the next run
+        os.remove(source_path)
+        # ffmpeg.Error carries stdout/stderr and does not survive the trip back from the worker process
+        raise RuntimeError(f'ffmpeg failed on {source_path}: {err.stderr.decode(errors="replace")[-500:] if err.stderr else err}')
+    os.replace(part_path, file_path)
+    os.remove(source_path)
+
+
+class EncoderPool:
+    """ CPU stage of the pipeline: downloaded sources wait in a bounded queue for one of `processes` ffmpeg workers """
+
+    def __init__(self, processes: int, queue_size: int, failures: Counter, journal: FailureJournal = None):
+        self._processes = processes
+        self._jobs: 'asyncio.Queue[EncodeJob]' = asyncio.Queue(maxsize=queue_size)
+        self._failures = failures
+        self._journal = journal
+        metrics.ENCODE_QUEUE.source = self._jobs.qsize
+
+    async def submit(self, job: EncodeJob):
+        TRACER.begin('encode_queued', 'queue', job.track_id, lane=job.lane)
+        await self._jobs.put(job)
+
+    async def close(self):
+        for _ in range(self._processes):
+            await self._jobs.put(None)
+
+    def _done(self, job: EncodeJob, success: bool):
+        if job.on_done is None:
+            return
+        try:
+            job.on_done(success)
+        except Exception as ex:
+            self._failures[job.lane] += 1
+            logger.error(f'failed to store {job.title}', exc_info=1)
+            self._journaled(job, 'store', ex)
+
+    def _journaled(self, job: EncodeJob, stage: str, error: BaseException):
+        if self._journal and job.track_id is not None:
+            self._journal.record(job.lane, job.track_id, stage, error)
+
+    async def run(self):
+        """ Encode submitted jobs until closed """
+        loop = asyncio.get_running_loop()
+
+        async def worker(pool: ProcessPoolExecutor, index: int):
+            asyncio.current_task().set_name(f'encode-{index}')
+            while True:
+                job = await self._jobs.get()
+                if job is None:
+                    return
+                TRACER.end('encode_queued', 'queue', job.track_id)
+                current_track.set(job.track_id)
+                logger.info(f'{"remuxing" if job.copy else "encoding"} {job.title}')
+                mode = 'copy' if job.copy else 'encode'
+                try:
+                    with metrics.ENCODE_SECONDS.time(mode=mode), TRACER.span(mode, 'encode', title=job.title):
+                        await loop.run_in_executor(
+                            pool, convert, job.source_path, job.file_path, job.copy, job.tags, job.artwork_path)
+                except Exception as ex:
+                    self._failures[job.lane] += 1
+                    metrics.ENCODE_FAILURES.inc()
+                    logger.error(f'failed to encode {job.title}', exc_info=1)
+                    self._journaled(job, 'encode', ex)
+                    self._done(job, False)
+                else:
+                    self._done(job, True)
+
+        with ProcessPoolExecutor(max_workers=self._processes) as pool:
+            await asyncio.gather(*(worker(pool, index) for index in range(self._processes)))
@@ -0,0 +1,108 @@
+import asyncio
+import logging
+import re
+from dataclasses import dataclass
+from logging import Logger
+from typing import List, Optional
+from urllib.parse import urljoin
+
+from aiohttp_retry import RetryClient
+
+from .shaping import MEDIA_TIMEOUT, TransferShaper
+
+logger: Logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Segment:
+    index: int
+    url: str
+    duration: float = 0.0
+
+
+def _attribute(tag: str, name: str) -> Optional[str]:
+    """ Value of attribute `name` of a playlist tag, quoted or not """
+    match = re.search(rf'[:,]{name}=(?:"([^"]*)"|([^,]*))', tag)
+    return (match.group(1) if match.group(1) is not None else match.group(2)) if match else None
+
+
+def parse_playlist(text: str, base_url: str) -> 'List[Segment]':
+    """ Parse a media m3u8 playlist into its ordered list of segments, led by the `EXT-X-MAP` initialization
+        section of fragmented mp4 streams. Encrypted and master playlists are rejected rather than saved as garbage """
+    if not text.startswith('#EXTM3U'):
+        raise ValueError(f'not an m3u8 playlist: {base_url}')
+    segments: List[Segment] = []
+    duration = 0.0
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith('#EXTINF:'):
+            duration = float(line[len('#EXTINF:'):].split(',', 1)[0] or 0)
+        elif line.startswith('#EXT-X-KEY:') and _attribute(line, 'METHOD') != 'NONE':
+            raise ValueError(f'encrypted playlist: {base_url}')
+        elif line.startswith('#EXT-X-STREAM-INF:'):
+            raise ValueError(f'master playlist, not a media one: {base_url}')
+        elif line.startswith('#EXT-X-MAP:'):
+            uri = _attribute(line, 'URI')
+            if uri is None or segments:
+                # a map changing mid-stream would need the segments split into several files
+                raise ValueError(f'unsupported EXT-X-MAP in {base_url}')
+            segments.append(Segment(index=0, url=urljoin(base_url, uri)))
+        elif not line.startswith('#'):
+            segments.append(Segment(index=len(segments), url=urljoin(base_url, line), duration=duration))
+            duration = 0.0
+    return segments
+
+
+class HLSDownloader:
+    CHUNK_SIZE: int = 64 * 1024
+
+    def __init__(self, session: RetryClient, window: int = 4, shaper: TransferShaper = None):
+        self._session = session
+        self._window = window
+        self._shaper = shaper or TransferShaper()
+
+    async def _fetch_playlist(self, playlist_url: str) -> 'List[Segment]':
+        async with self._shaper.connection(playlist_url), self._session.get(
+                playlist_url, raise_for_status=True, timeout=MEDIA_TIMEOUT) as resp:
+            return parse_playlist(await resp.text(), playlist_url)
+
+    async def _fetch_segment(self, segment: Segment, flow) -> bytes:
+        async with self._shaper.connection(segment.url), self._session.get(
+                segment.url, raise_for_status=True, timeout=MEDIA_TIMEOUT) as resp:
+            payload = bytearray()
+            async for chunk in resp.content.iter_chunked(self.CHUNK_SIZE):
+                await self._shaper.consume(len(chunk), flow)
+                payload += chunk
+            return bytes(payload)
+
+    async def download(self, playlist_url: str, output, start: int = 0, on_segment=None):
+        """ Fetch the playlist segments from `start`, at most `window` at a time, writing them to the `output`
+            aiofiles handle in order and awaiting `on_segment(segment, size)` after each one is written """
+        segments = (await self._fetch_playlist(playlist_url))[start:]
+        logger.debug(f'{len(segments)} segments left in {playlist_url}')
+        # segments in flight at once are consecutive, naming their tasks after their slot in the window gives each
+        # download one trace row per slot
+        name = asyncio.current_task().get_name()
+        # the segments of a playlist are one flow, sharing the bandwidth budget evenly with other tracks
+        flow = self._shaper.flow()
+
+        def fetch(index: int) -> asyncio.Task:
+            return asyncio.create_task(
+                self._fetch_segment(segments[index], flow), name=f'{name}.{index % self._window}')
+
+        pending = [fetch(index) for index in range(min(self._window, len(segments)))]
+        next_segment = len(pending)
+        try:
+            for segment in segments:
+                payload = await pending.pop(0)
+                if next_segment < len(segments):
+                    pending.append(fetch(next_segment))
+                    next_segment += 1
+                await output.write(payload)
+                if on_segment:
+                    await on_segment(segment, len(payload))
+        finally:
+            for task in pending:
+                task.cancel()
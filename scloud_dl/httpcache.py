@@ -0,0 +1,132 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+from dataclasses import dataclass
+from logging import Logger
+from typing import Optional
+from urllib.parse import parse_qsl, urlencode, urlparse
+
+logger: Logger = logging.getLogger(__name__)
+
+# query parameters that change between runs without changing the resource
+VOLATILE_PARAMS: set = {'client_id'}
+
+
+def cache_key(url: str, params: dict = None) -> str:
+    """ The url with its query parameters, volatile ones excluded, in a stable order """
+    parsed = urlparse(url)
+    query = dict(parse_qsl(parsed.query))
+    query.update({name: str(value) for (name, value) in (params or {}).items()})
+    query = sorted((name, value) for (name, value) in query.items() if name not in VOLATILE_PARAMS)
+    return parsed._replace(query=urlencode(query)).geturl()
+
+
+@dataclass
+class CachedResponse:
+    key: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    digest: str
+    meta: dict
+
+    def validators(self) -> dict:
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class HttpCache:
+    """ Response bodies on disk with their validators, evicting the least recently used ones beyond `max_bytes`.
+        Callers revalidate with `If-None-Match`/`If-Modified-Since`, and when the api sends no validators a body
+        whose hash did not change is reported unchanged all the same """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            etag TEXT,
+            last_modified TEXT,
+            digest TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            meta TEXT NOT NULL,
+            accessed_at REAL NOT NULL
+        )"""
+
+    def __init__(self, root: str = './cache/http', max_bytes: int = 256 * 1024 * 1024):
+        os.makedirs(root, exist_ok=True)
+        self._root = root
+        self._max_bytes = max_bytes
+        self._connection = sqlite3.connect(f'{root}/index.db')
+        self._connection.execute(self.SCHEMA)
+        self._connection.commit()
+        self._size: int = self._connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def _body_path(self, key: str) -> str:
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return f'{self._root}/{digest[:2]}/{digest}'
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        row = self._connection.execute(
+            'SELECT etag, last_modified, digest, meta FROM responses WHERE key = ?', (key,)).fetchone()
+        if row is None or not os.path.exists(self._body_path(key)):
+            return None
+        (etag, last_modified, digest, meta) = row
+        return CachedResponse(key, etag, last_modified, digest, json.loads(meta))
+
+    def touch(self, key: str):
+        with self._connection:
+            self._connection.execute('UPDATE responses SET accessed_at = ? WHERE key = ?', (time.time(), key))
+
+    def body(self, key: str) -> bytes:
+        with open(self._body_path(key), 'rb') as f:
+            return f.read()
+
+    def set_meta(self, key: str, meta: dict):
+        """ Attach what callers learnt from parsing a body, kept until the body changes """
+        with self._connection:
+            self._connection.execute('UPDATE responses SET meta = ? WHERE key = ?', (json.dumps(meta), key))
+
+    def put(self, key: str, body: bytes, headers) -> bool:
+        """ Store `body` with the validators in response `headers`, returning whether it differs from the cached one """
+        digest = hashlib.sha256(body).hexdigest()
+        previous = self._connection.execute('SELECT digest, size, meta FROM responses WHERE key = ?', (key,)).fetchone()
+        changed = previous is None or previous[0] != digest
+        path = self._body_path(key)
+        if changed:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f'{path}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(body)
+            os.replace(tmp_path, path)
+        with self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (key, headers.get('ETag'), headers.get('Last-Modified'), digest, len(body),
+                 '{}' if changed else previous[2], time.time()))
+        self._size += len(body) - (previous[1] if previous else 0)
+        if self._size > self._max_bytes:
+            self._evict()
+        return changed
+
+    def _evict(self):
+        """ Drop least recently used responses down to 90% of `max_bytes` """
+        target = self._max_bytes * 0.9
+        evicted = []
+        for (key, size) in self._connection.execute('SELECT key, size FROM responses ORDER BY accessed_at'):
+            if self._size <= target:
+                break
+            evicted.append((key,))
+            self._size -= size
+            if os.path.exists(self._body_path(key)):
+                os.remove(self._body_path(key))
+        with self._connection:
+            self._connection.executemany('DELETE FROM responses WHERE key = ?', evicted)
+        logger.debug(f'evicted {len(evicted)} cached responses')
+
+    def close(self):
+        self._connection.close()
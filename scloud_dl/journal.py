@@ -0,0 +1,83 @@
+import logging
+import os
+import sqlite3
+import time
+from logging import Logger
+from typing import List
+
+logger: Logger = logging.getLogger(__name__)
+
+# seconds before a first retry by error class, doubled on every further failure
+BACKOFF: dict = {
+    # dropped connections and timeouts usually clear up quickly
+    'ClientConnectionError': 60,
+    'ClientPayloadError': 60,
+    'ServerDisconnectedError': 60,
+    'TimeoutError': 60,
+    # http errors after retries, ex. sustained throttling or a track blocked in this region
+    'ClientResponseError': 15 * 60,
+    # no playable stream, the track was removed or is not streamable here
+    'LookupError': 24 * 3600,
+    # ffmpeg rejecting a source
+    'RuntimeError': 6 * 3600,
+}
+DEFAULT_BACKOFF: float = 10 * 60
+MAX_BACKOFF: float = 7 * 24 * 3600
+
+
+class FailureJournal:
+    """ Per-profile record of the tracks that failed to resolve or download, with the stage and error class
+        of their last failure, kept until a later run stores them """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS failures (
+            profile TEXT NOT NULL,
+            track_id INTEGER NOT NULL,
+            stage TEXT NOT NULL,
+            error TEXT NOT NULL,
+            message TEXT,
+            attempts INTEGER NOT NULL,
+            failed_at REAL NOT NULL,
+            retry_at REAL NOT NULL,
+            PRIMARY KEY (profile, track_id)
+        )"""
+
+    def __init__(self, db_path: str = './cache/failures.db'):
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        # waits as long as the work queue does when both share a database
+        self._connection = sqlite3.connect(db_path, timeout=30)
+        self._connection.execute(self.SCHEMA)
+        self._connection.commit()
+
+    @staticmethod
+    def _backoff(error: BaseException) -> float:
+        for cls in type(error).__mro__:
+            if cls.__name__ in BACKOFF:
+                return BACKOFF[cls.__name__]
+        return DEFAULT_BACKOFF
+
+    def record(self, profile: str, track_id: int, stage: str, error: BaseException):
+        error_class = type(error).__name__
+        row = self._connection.execute(
+            'SELECT attempts FROM failures WHERE profile = ? AND track_id = ?', (profile, track_id)).fetchone()
+        attempts = row[0] + 1 if row else 1
+        backoff = min(MAX_BACKOFF, self._backoff(error) * 2 ** (attempts - 1))
+        now = time.time()
+        with self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO failures VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (profile, track_id, stage, error_class, str(error)[:500], attempts, now, now + backoff))
+        logger.debug(f'journaled {stage} failure of track {track_id} for {profile}: {error_class}, attempt {attempts}')
+
+    def resolved(self, profile: str, track_id: int):
+        with self._connection:
+            self._connection.execute('DELETE FROM failures WHERE profile = ? AND track_id = ?', (profile, track_id))
+
+    def due(self, profile: str) -> List[int]:
+        """ Ids of the journaled tracks of `profile` whose backoff has elapsed """
+        return [track_id for (track_id,) in self._connection.execute(
+            'SELECT track_id FROM failures WHERE profile = ? AND retry_at <= ? ORDER BY failed_at',
+            (profile, time.time()))]
+
+    def close(self):
+        self._connection.close()
@@ -0,0 +1,215 @@
+import bisect
+import json
+import logging
+import time
+from contextlib import contextmanager
+from logging import Logger
+from typing import Callable, Dict, Iterable, Tuple
+
+from aiohttp import TraceConfig
+
+logger: Logger = logging.getLogger(__name__)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{value}"' for (name, value) in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metric:
+    kind: str = 'untyped'
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        return []
+
+    def prometheus(self) -> str:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        lines += [f'{name}{labels} {value:g}' for (name, labels, value) in self.samples()]
+        return '\n'.join(lines)
+
+    def summary(self):
+        return {','.join(key) or 'total': value for (key, value) in self._values.items()}
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def total(self) -> float:
+        return sum(self._values.values())
+
+    def samples(self):
+        return [(self.name, _format_labels(self.labels, key), value) for (key, value) in self._values.items()]
+
+
+class Gauge(Metric):
+    """ Gauge read from `source` at collection time """
+    kind = 'gauge'
+
+    def __init__(self, name: str, help: str, source: Callable[[], float] = None):
+        super().__init__(name, help)
+        self.source = source
+
+    def samples(self):
+        return [(self.name, '', self.source())] if self.source else []
+
+    def summary(self):
+        return self.source() if self.source else None
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+    DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        if key not in self._values:
+            # per-bucket counts, then sum and count
+            self._values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        values = self._values[key]
+        values[bisect.bisect_left(self.buckets, value)] += 1
+        values[-2] += value
+        values[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started, **labels)
+
+    def samples(self):
+        samples = []
+        for (key, values) in self._values.items():
+            cumulative = 0
+            for (bound, count) in zip(self.buckets + (float('inf'),), values):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else f'{bound:g}'
+                samples.append((f'{self.name}_bucket', _format_labels(self.labels, key, f'le="{le}"'), cumulative))
+            samples.append((f'{self.name}_sum', _format_labels(self.labels, key), values[-2]))
+            samples.append((f'{self.name}_count', _format_labels(self.labels, key), values[-1]))
+        return samples
+
+    def summary(self):
+        return {
+            ','.join(key) or 'total': {'count': values[-1], 'sum': round(values[-2], 3),
+                                       'mean': round(values[-2] / values[-1], 3) if values[-1] else None}
+            for (key, values) in self._values.items()}
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self.started: float = time.time()
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, source: Callable[[], float] = None) -> Gauge:
+        return self.register(Gauge(name, help, source))
+
+    def histogram(self, name: str, help: str, labels: Iterable[str] = (), **kwargs) -> Histogram:
+        return self.register(Histogram(name, help, labels, **kwargs))
+
+    def prometheus(self) -> str:
+        return '\n'.join(metric.prometheus() for metric in self._metrics.values()) + '\n'
+
+    def summary(self) -> dict:
+        elapsed = time.time() - self.started
+        summary = {'elapsed_seconds': round(elapsed, 3)}
+        summary.update({name: metric.summary() for (name, metric) in self._metrics.items()})
+        downloaded = BYTES_DOWNLOADED.total()
+        summary['bytes_per_second'] = round(downloaded / elapsed, 1) if elapsed else None
+        return summary
+
+    def write_summary(self, path: str):
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+        logger.info(f'metrics summary written to {path}')
+
+    async def serve(self, port: int, host: str = '127.0.0.1'):
+        """ Expose the registry as prometheus text on http://host:port/metrics, returning the runner to clean up """
+        from aiohttp import web
+
+        async def metrics(request):
+            return web.Response(text=self.prometheus(), content_type='text/plain', charset='utf-8')
+
+        app = web.Application()
+        app.router.add_get('/metrics', metrics)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        logger.info(f'serving metrics on http://{host}:{port}/metrics')
+        return runner
+
+
+REGISTRY = Registry()
+
+PAGES = REGISTRY.counter('scloud_dl_pages_total', 'collection pages fetched')
+PAGE_SECONDS = REGISTRY.histogram('scloud_dl_page_seconds', 'collection page fetch latency')
+HTTP_CACHE = REGISTRY.counter(
+    'scloud_dl_http_cache_total', 'revalidated api responses by result: not_modified, unchanged or changed', ['result'])
+API_REQUESTS = REGISTRY.counter('scloud_dl_api_requests_total', 'api responses by status, retries included', ['status'])
+API_RETRIES = REGISTRY.counter('scloud_dl_api_retries_total', 'api responses that triggered a retry by status', ['status'])
+TRACKS_DEDUPLICATED = REGISTRY.counter(
+    'scloud_dl_tracks_deduplicated_total', 'tracks skipped as already listed by another collection of the profile')
+TRACKS_HYDRATED = REGISTRY.counter('scloud_dl_tracks_hydrated_total', 'incomplete track payloads fetched again by id')
+TRACKS_RESOLVED = REGISTRY.counter('scloud_dl_tracks_resolved_total', 'tracks resolved to a stream url', ['source'])
+RESOLVE_SECONDS = REGISTRY.histogram('scloud_dl_resolve_seconds', 'stream url resolution latency', ['source'])
+RESOLVE_FAILURES = REGISTRY.counter('scloud_dl_resolve_failures_total', 'tracks that could not be resolved')
+TRACKS_DOWNLOADED = REGISTRY.counter('scloud_dl_tracks_downloaded_total', 'tracks downloaded', ['protocol'])
+DOWNLOAD_SECONDS = REGISTRY.histogram('scloud_dl_download_seconds', 'track download wall time', ['protocol'])
+DOWNLOAD_FAILURES = REGISTRY.counter('scloud_dl_download_failures_total', 'tracks whose download failed')
+BYTES_DOWNLOADED = REGISTRY.counter('scloud_dl_bytes_downloaded_total', 'media bytes downloaded')
+ENCODE_SECONDS = REGISTRY.histogram('scloud_dl_encode_seconds', 'ffmpeg wall time', ['mode'])
+ENCODE_FAILURES = REGISTRY.counter('scloud_dl_encode_failures_total', 'tracks whose remux or encode failed')
+DOWNLOAD_WORKERS = REGISTRY.gauge('scloud_dl_download_workers', 'current limit on concurrent downloads')
+BANDWIDTH_LIMIT = REGISTRY.gauge('scloud_dl_bandwidth_limit_bytes', 'media transfer budget in bytes per second, 0 for unlimited')
+DOWNLOAD_QUEUE = REGISTRY.gauge('scloud_dl_download_queue_depth', 'resolved tracks waiting for a download worker')
+ENCODE_QUEUE = REGISTRY.gauge('scloud_dl_encode_queue_depth', 'downloaded sources waiting for an encoder')
+
+
+def trace_config(hosts: Iterable[str], retry_statuses: Iterable[int], attempts: int) -> TraceConfig:
+    """ aiohttp trace hooks counting api responses, and the ones a retry follows, per status """
+    hosts = set(hosts)
+    retry_statuses = set(retry_statuses)
+    trace_config = TraceConfig()
+
+    async def on_request_end(session, context, params):
+        if params.url.host not in hosts:
+            return
+        status = params.response.status
+        API_REQUESTS.inc(status=status)
+        attempt = (context.trace_request_ctx or {}).get('current_attempt', attempts)
+        if attempt < attempts and (status in retry_statuses or status >= 500):
+            API_RETRIES.inc(status=status)
+
+    trace_config.on_request_end.append(on_request_end)
+    return trace_config
@@ -0,0 +1,267 @@
+from typing import List, Optional
+
+
+class _Nested:
+    """ Attribute holding a raw nested payload in the `_{name}` slot, decoded into `model` on first read """
+
+    def __init__(self, model):
+        self._model = model
+
+    def __set_name__(self, owner, name):
+        self._slot = getattr(owner, f'_{name}')
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        value = self._slot.__get__(instance, owner)
+        if isinstance(value, dict):
+            value = self._model.decode(value)
+            self._slot.__set__(instance, value)
+        return value
+
+
+class Model:
+    """ Compact model of an api-v2 payload. Only the fields the downloader reads are kept, the rest of a payload
+        is dropped once decoded, and nested objects like a track's `user` stay raw until read """
+    __slots__ = ()
+
+    def __repr__(self) -> str:
+        fields = ', '.join(f'{name.lstrip("_")}={getattr(self, name)!r}' for name in self.__slots__)
+        return f'{type(self).__name__}({fields})'
+
+
+class Format(Model):
+    __slots__ = ('protocol', 'mime_type')
+
+    def __init__(self, protocol: str, mime_type: str):
+        self.protocol = protocol
+        self.mime_type = mime_type
+
+    @classmethod
+    def decode(cls, payload: dict) -> 'Format':
+        return cls(payload['protocol'], payload['mime_type'])
+
+
+class Transcoding(Model):
+    __slots__ = ('url', 'preset', 'duration', 'snipped', 'format', 'quality')
+
+    def __init__(self, url: str, preset: str, duration: int, snipped: bool, format: Format, quality: str = None):
+        self.url = url
+        self.preset = preset
+        self.duration = duration
+        self.snipped = snipped
+        self.format = format
+        self.quality = quality
+
+    @classmethod
+    def decode(cls, payload: dict) -> 'Transcoding':
+        return cls(payload['url'], payload['preset'], payload.get('duration'), payload.get('snipped', False),
+                   Format.decode(payload['format']), payload.get('quality'))
+
+
+class Medium(Model):
+    __slots__ = ('transcodings',)
+
+    def __init__(self, transcodings: List[Transcoding]):
+        self.transcodings = transcodings
+
+    @classmethod
+    def decode(cls, payload: dict) -> 'Medium':
+        return cls([Transcoding.decode(transcoding) for transcoding in payload.get('transcodings') or ()])
+
+
+class User(Model):
+    __slots__ = ('id', 'username', 'full_name', 'permalink_url', 'avatar_url', 'city', 'country_code')
+
+    def __init__(self, id: int, username: str, full_name: str = None, permalink_url: str = None,
+                 avatar_url: str = None, city: str = None, country_code: str = None):
+        self.id = id
+        self.username = username
+        self.full_name = full_name
+        self.permalink_url = permalink_url
+        self.avatar_url = avatar_url
+        self.city = city
+        self.country_code = country_code
+
+    @classmethod
+    def decode(cls, payload: dict) -> 'User':
+        return cls(payload['id'], payload.get('username'), payload.get('full_name'), payload.get('permalink_url'),
+                   payload.get('avatar_url'), payload.get('city'), payload.get('country_code'))
+
+
+class PublisherMetadatum(Model):
+    __slots__ = ('id', 'artist', 'album_title', 'release_title', 'publisher', 'isrc', 'explicit')
+
+    def __init__(self, id: int, artist: str = None, album_title: str = None, release_title: str = None,
+                 publisher: str = None, isrc: str = None, explicit: bool = None):
+        self.id = id
+        self.artist = artist
+        self.album_title = album_title
+        self.release_title = release_title
+        self.publisher = publisher
+        self.isrc = isrc
+        self.explicit = explicit
+
+    @classmethod
+    def decode(cls, payload: dict) -> 'PublisherMetadatum':
+        return cls(payload.get('id'), payload.get('artist'), payload.get('album_title'), payload.get('release_title'),
+                   payload.get('publisher'), payload.get('isrc'), payload.get('explicit'))
+
+
+class VisualEntry(Model):
+    __slots__ = ('urn', 'entry_time', 'visual_url')
+
+    def __init__(self, urn: str, entry_time: int, visual_url: str):
+        self.urn = urn
+        self.entry_time = entry_time
+        self.visual_url = visual_url
+
+    @classmethod
+    def decode(cls, payload: dict) -> 'VisualEntry':
+        return cls(payload.get('urn'), payload.get('entry_time'), payload.get('visual_url'))
+
+
+class Visual(Model):
+    __slots__ = ('urn', 'enabled', 'visuals')
+
+    def __init__(self, urn: str, enabled: bool, visuals: List[VisualEntry]):
+        self.urn = urn
+        self.enabled = enabled
+        self.visuals = visuals
+
+    @classmethod
+    def decode(cls, payload: dict) -> 'Visual':
+        return cls(payload.get('urn'), payload.get('enabled', False),
+                   [VisualEntry.decode(visual) for visual in payload.get('visuals') or ()])
+
+
+class Track(Model):
+    """ A track as listed in collections or returned by `/tracks`, possibly a stub without title nor media """
+    __slots__ = ('id', 'urn', 'kind', 'title', 'created_at', 'duration', 'full_duration', 'genre', 'tag_list',
+                 'artwork_url', 'permalink_url', 'release_date', 'display_date', 'policy', 'user_id', 'media',
+                 '_user', '_publisher_metadata', '_visuals')
+
+    user: Optional[User] = _Nested(User)
+    publisher_metadata: Optional[PublisherMetadatum] = _Nested(PublisherMetadatum)
+    visuals: Optional[Visual] = _Nested(Visual)
+
+    def __init__(self, id: int, urn: str = None, kind: str = 'track', title: str = None, created_at: str = None,
+                 duration: int = None, full_duration: int = None, genre: str = None, tag_list: str = None,
+                 artwork_url: str = None, permalink_url: str = None, release_date: str = None,
+                 display_date: str = None, policy: str = None, user_id: int = None, media: Medium = None,
+                 user: dict = None, publisher_metadata: dict = None, visuals: dict = None):
+        self.id = id
+        self.urn = urn
+        self.kind = kind
+        self.title = title
+        self.created_at = created_at
+        self.duration = duration
+        self.full_duration = full_duration
+        self.genre = genre
+        self.tag_list = tag_list
+        self.artwork_url = artwork_url
+        self.permalink_url = permalink_url
+        self.release_date = release_date
+        self.display_date = display_date
+        self.policy = policy
+        self.user_id = user_id
+        self.media = media
+        self._user = user
+        self._publisher_metadata = publisher_metadata
+        self._visuals = visuals
+
+    @property
+    def is_complete(self) -> bool:
+        return bool(self.title and self.media and self.media.transcodings)
+
+    @classmethod
+    def decode(cls, payload: dict) -> 'Track':
+        media = payload.get('media')
+        return cls(
+            payload['id'], payload.get('urn'), payload.get('kind', 'track'), payload.get('title'),
+            payload.get('created_at'), payload.get('duration'), payload.get('full_duration'), payload.get('genre'),
+            payload.get('tag_list'), payload.get('artwork_url'), payload.get('permalink_url'),
+            payload.get('release_date'), payload.get('display_date'), payload.get('policy'), payload.get('user_id'),
+            Medium.decode(media) if media else None,
+            payload.get('user'), payload.get('publisher_metadata'), payload.get('visuals'))
+
+
+class Playlist(Model):
+    """ A playlist or album. Listings carry its `tracks` complete for the first few and as stubs for the rest,
+        or omit them altogether, leaving `tracks` None until `/playlists/{id}` is fetched """
+    __slots__ = ('id', 'urn', 'kind', 'title', 'created_at', 'last_modified', 'track_count', 'tracks')
+
+    def __init__(self, id: int, urn: str = None, kind: str = 'playlist', title: str = None, created_at: str = None,
+                 last_modified: str = None, track_count: int = None, tracks: List[Track] = None):
+        self.id = id
+        self.urn = urn
+        self.kind = kind
+        self.title = title
+        self.created_at = created_at
+        self.last_modified = last_modified
+        self.track_count = track_count
+        self.tracks = tracks
+
+    @classmethod
+    def decode(cls, payload: dict) -> 'Playlist':
+        tracks = payload.get('tracks')
+        return cls(
+            payload['id'], payload.get('urn'), payload.get('kind', 'playlist'), payload.get('title'),
+            payload.get('created_at'), payload.get('last_modified'), payload.get('track_count'),
+            [Track.decode(track) for track in tracks] if tracks is not None else None)
+
+
+class Collection(Model):
+    """ An entry of a collection page: a like or a repost wrapping a track or a playlist, or for uploads and
+        playlists the listed object itself """
+    __slots__ = ('created_at', 'kind', 'track', 'playlist')
+
+    def __init__(self, created_at: str, kind: str, track: Track = None, playlist: Playlist = None):
+        self.created_at = created_at
+        self.kind = kind
+        self.track = track
+        self.playlist = playlist
+
+    @classmethod
+    def decode(cls, payload: dict) -> 'Collection':
+        kind = payload.get('kind')
+        if kind == 'track':
+            return cls(payload['created_at'], kind, track=Track.decode(payload))
+        if kind == 'playlist':
+            return cls(payload['created_at'], kind, playlist=Playlist.decode(payload))
+        (track, playlist) = (payload.get('track'), payload.get('playlist'))
+        return cls(payload['created_at'], payload.get('type') or kind,
+                   Track.decode(track) if track else None, Playlist.decode(playlist) if playlist else None)
+
+
+class Page(Model):
+    __slots__ = ('collection', 'next_href')
+
+    def __init__(self, collection: List[Collection], next_href: Optional[str]):
+        self.collection = collection
+        self.next_href = next_href
+
+    @classmethod
+    def decode(cls, payload: dict) -> 'Page':
+        return cls([Collection.decode(item) for item in payload['collection']], payload.get('next_href'))
+
+    @classmethod
+    async def stream(cls, content) -> 'Page':
+        """ Decode a page from an async byte stream one collection entry at a time, so that the raw payload of
+            a whole page is never held in memory. Requires ijson """
+        import ijson
+
+        collection = []
+        next_href = None
+        builder = None
+        async for (prefix, event, value) in ijson.parse_async(content, use_float=True):
+            if prefix == 'collection.item' and event == 'start_map':
+                builder = ijson.ObjectBuilder()
+            if builder is not None:
+                builder.event(event, value)
+                if prefix == 'collection.item' and event == 'end_map':
+                    collection.append(Collection.decode(builder.value))
+                    builder = None
+            elif prefix == 'next_href':
+                next_href = value
+        return cls(collection, next_href)
@@ -0,0 +1,72 @@
+import asyncio
+import logging
+from collections import deque
+from logging import Logger
+from typing import Awaitable, Callable, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+
+logger: Logger = logging.getLogger(__name__)
+
+
+def _offset(href: str) -> Optional[int]:
+    offset = dict(parse_qsl(urlparse(href).query)).get('offset', '0')
+    return int(offset) if offset.isdigit() else None
+
+
+def _with_offset(href: str, offset: int) -> str:
+    url = urlparse(href)
+    query = dict(parse_qsl(url.query))
+    query['offset'] = str(offset)
+    return urlunparse(url._replace(query=urlencode(query)))
+
+
+def _same_page(href: str, other: str) -> bool:
+    return urlparse(href).path == urlparse(other).path and _offset(href) == _offset(other)
+
+
+class Pager:
+    """ Walks a `next_href` chain keeping up to `prefetch` pages in flight ahead of the consumer. The next page is
+        requested as soon as its href is known, and when hrefs carry a numeric offset the following ones are
+        predicted and fetched concurrently. Cursor based hrefs fall back to chaining one page ahead, and a
+        `prefetch` of 0 only requests a page once the consumer asks for it """
+
+    def __init__(self, fetch: Callable[[str], Awaitable[Tuple[list, Optional[str]]]], prefetch: int = 2):
+        self._fetch = fetch
+        self._prefetch = max(0, prefetch)
+
+    def _request(self, pending: deque, href: str):
+        pending.append((href, asyncio.create_task(self._fetch(href))))
+
+    def _speculate(self, pending: deque, href: str, next_href: str):
+        (offset, next_offset) = (_offset(href), _offset(next_href))
+        if offset is None or next_offset is None or next_offset <= offset:
+            return
+        step = next_offset - offset
+        while len(pending) < self._prefetch:
+            predicted = _with_offset(next_href, _offset(pending[-1][0]) + step)
+            logger.debug(f'prefetching predicted page {predicted}')
+            self._request(pending, predicted)
+
+    async def pages(self, href: str):
+        """ Yield page collections in order """
+        pending: deque = deque()
+        self._request(pending, href)
+        try:
+            while pending:
+                (href, task) = pending.popleft()
+                (collection, next_href) = await task
+                if pending and (next_href is None or not _same_page(pending[0][0], next_href)):
+                    logger.debug(f'predicted pages do not follow {href}, dropping them')
+                    for (_, speculative) in pending:
+                        speculative.cancel()
+                    pending.clear()
+                if next_href is not None and self._prefetch:
+                    if not pending:
+                        self._request(pending, next_href)
+                    self._speculate(pending, href, next_href)
+                yield collection
+                if next_href is not None and not pending:
+                    self._request(pending, next_href)
+        finally:
+            for (_, task) in pending:
+                task.cancel()
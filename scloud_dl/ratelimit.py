@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import time
+from email.utils import parsedate_to_datetime
+from logging import Logger
+from typing import Iterable, Optional
+
+from aiohttp import TraceConfig
+
+from .tracing import TRACER
+
+logger: Logger = logging.getLogger(__name__)
+
+
+def retry_after(value: Optional[str]) -> Optional[float]:
+    """ Seconds to wait according to a `Retry-After` header, given either as seconds or as an http date """
+    if not value:
+        return None
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveRateLimiter:
+    """ Token bucket whose rate grows additively on success and shrinks multiplicatively on 429 (AIMD),
+        with a cap on the number of requests in flight """
+
+    def __init__(self, rate: float = 10, min_rate: float = 0.5, max_rate: float = 50,
+                 max_in_flight: int = 16, increase: float = 0.5, decrease: float = 0.5):
+        self._rate = rate
+        self._min_rate = min_rate
+        self._max_rate = max_rate
+        self._increase = increase
+        self._decrease = decrease
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+        self._lock = asyncio.Lock()
+        self._tokens = 1.0
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    @property
+    def rate(self) -> float:
+        return self._rate
+
+    async def _take_token(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(1.0, self._tokens + (now - self._updated) * self._rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self._rate)
+
+    async def acquire(self):
+        await self._in_flight.acquire()
+        try:
+            await self._take_token()
+        except BaseException:
+            self._in_flight.release()
+            raise
+
+    def release(self, status: int = None, retry_after_seconds: float = None):
+        self._in_flight.release()
+        if status == 429:
+            self._rate = max(self._min_rate, self._rate * self._decrease)
+            if retry_after_seconds:
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after_seconds)
+            logger.warning(f'throttled, request rate lowered to {self._rate:.2f}/s')
+        elif status is not None and status < 400:
+            self._rate = min(self._max_rate, self._rate + self._increase)
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+
+    def trace_config(self, hosts: Iterable[str]) -> TraceConfig:
+        """ aiohttp trace hooks gating every request, including retries, sent to one of `hosts` """
+        hosts = set(hosts)
+        trace_config = TraceConfig()
+
+        async def on_request_start(session, context, params):
+            context.limited = params.url.host in hosts
+            if context.limited:
+                with TRACER.span('rate_limit', 'http', rate=round(self._rate, 2)):
+                    await self.acquire()
+
+        async def on_request_end(session, context, params):
+            if context.limited:
+                self.release(params.response.status, retry_after(params.response.headers.get('Retry-After')))
+
+        async def on_request_exception(session, context, params):
+            if context.limited:
+                self.release()
+
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_request_end.append(on_request_end)
+        trace_config.on_request_exception.append(on_request_exception)
+        return trace_config
@@ -0,0 +1,67 @@
+import asyncio
+import itertools
+import logging
+from collections import deque
+from logging import Logger
+from typing import Callable, Iterable, Optional
+
+from .tracing import TRACER
+
+logger: Logger = logging.getLogger(__name__)
+
+# sort keys of the download orders, on the expected duration of a track
+ORDERS: 'dict[str, Optional[Callable]]' = {
+    'listed': None,
+    'longest': lambda track: -(track.duration or 0),
+    'shortest': lambda track: track.duration or 0,
+}
+
+
+class FairScheduler:
+    """ Hands items from several bounded producer lanes to a shared pool of consumers, round-robin across lanes
+        so that a long lane cannot starve the others. With a `key`, each lane hands out its buffered items
+        smallest key first instead of in arrival order """
+
+    def __init__(self, lanes: Iterable[str], maxsize: int, key: Callable = None):
+        self._key = key
+        self._sequence = itertools.count()
+        queue = asyncio.PriorityQueue if key else asyncio.Queue
+        self._queues = {lane: queue(maxsize=maxsize) for lane in lanes}
+        self._order = deque(self._queues)
+        self._open = set(self._queues)
+        self._ready = asyncio.Condition()
+
+    def qsize(self) -> int:
+        return sum(queue.qsize() for queue in self._queues.values())
+
+    async def put(self, lane: str, item):
+        # the sequence number keeps arrival order among equal keys and spares comparing items
+        await self._queues[lane].put((self._key(item), next(self._sequence), item) if self._key else item)
+        TRACER.begin('queued', 'queue', item.id, lane=lane)
+        async with self._ready:
+            self._ready.notify()
+
+    async def close(self, lane: str):
+        """ Mark `lane` as exhausted, consumers are released once every lane is closed and drained """
+        self._open.discard(lane)
+        async with self._ready:
+            self._ready.notify_all()
+
+    async def get(self):
+        """ Next `(lane, item)` in round-robin order, or None once every lane is closed and drained """
+        async with self._ready:
+            while True:
+                for _ in range(len(self._order)):
+                    lane = self._order[0]
+                    self._order.rotate(-1)
+                    if not self._queues[lane].empty():
+                        item = self._queues[lane].get_nowait()
+                        item = item[-1] if self._key else item
+                        TRACER.end('queued', 'queue', item.id)
+                        return (lane, item)
+                if not self._open:
+                    return None
+                await self._ready.wait()
+
+    def task_done(self, scheduled: tuple, stored):
+        """ Called by consumers once an item handed out by `get` is stored, a no-op for the in-memory queues """
@@ -212,8 +212,8 @@ class SeleniumCredentialsProvider(CredentialsProviderBase):
             'Network.requestWillBeSent')
         self.__driver_factory = DriverFactory(interceptors=[self.__interceptor])
 
-    async def credentials(self, profile_username):
-        credentials = Credentials.load_credentials('./cache/credentials.json')
+    async def credentials(self, profile_username, use_cache: bool = True):
+        credentials = Credentials.load_credentials('./cache/credentials.json') if use_cache else None
         if credentials:
             return credentials
         
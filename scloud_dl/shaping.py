@@ -0,0 +1,156 @@
+import asyncio
+import logging
+import os
+import signal
+import time
+from logging import Logger
+from typing import List, Optional, Tuple
+from urllib.parse import urlparse
+
+from aiohttp import ClientTimeout
+
+logger: Logger = logging.getLogger(__name__)
+
+# media transfers run as long as throttling and the size of the track require, only a stalled socket fails them,
+# unlike api calls bound by the session's total deadline
+MEDIA_TIMEOUT: ClientTimeout = ClientTimeout(total=None, sock_connect=30, sock_read=60)
+
+UNITS: dict = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+def parse_rate(value: str) -> float:
+    """ Bytes per second from a number with an optional K, M or G suffix, ex. `512K` or `2.5M`, 0 for unlimited """
+    value = value.strip().upper().replace('/S', '').rstrip('B')
+    unit = value[-1:] if value[-1:] in UNITS else ''
+    return float(value[:len(value) - len(unit)]) * UNITS[unit]
+
+
+def parse_schedule(text: str) -> 'List[Tuple[int, float]]':
+    """ `HH:MM rate` lines, each rate applying from its time of day until the next one, sorted by minute of the day """
+    schedule = []
+    for line in text.splitlines():
+        line = line.split('#', 1)[0].strip()
+        if not line:
+            continue
+        (at, rate) = line.split()
+        (hours, minutes) = at.split(':')
+        schedule.append((int(hours) * 60 + int(minutes), parse_rate(rate)))
+    return sorted(schedule)
+
+
+def scheduled_rate(schedule: 'List[Tuple[int, float]]', minute: int) -> Optional[float]:
+    """ Rate in effect at `minute` of the day, the last entry of the day before carrying over past midnight """
+    if not schedule:
+        return None
+    rate = schedule[-1][1]
+    for (start, start_rate) in schedule:
+        if start > minute:
+            break
+        rate = start_rate
+    return rate
+
+
+class _Unlimited:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        pass
+
+
+class TransferShaper:
+    """ Shapes media transfers: a global bytes/sec budget, 0 for unlimited, that can change while transfers run,
+        and at most `connections_per_host` connections to each host. The budget is handed out in the order it is
+        asked for, one waiter per flow at a time, so that active tracks share it round-robin whatever their number
+        of connections """
+
+    def __init__(self, rate: float = 0, connections_per_host: int = 0, burst: float = 0.25):
+        self._rate = rate
+        # seconds of budget that may be spent at once after an idle period
+        self._burst = burst
+        self._tokens = 0.0
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+        self._connections_per_host = connections_per_host
+        self._hosts: 'dict[str, asyncio.Semaphore]' = {}
+
+    @property
+    def rate(self) -> float:
+        return self._rate
+
+    @rate.setter
+    def rate(self, rate: float):
+        if rate != self._rate:
+            logger.info(f'bandwidth limit set to {f"{rate / 1024:.0f} KiB/s" if rate else "unlimited"}')
+        self._rate = rate
+
+    def connection(self, url: str):
+        """ Context manager holding one of the connections allowed to the host of `url` """
+        if not self._connections_per_host:
+            return _Unlimited()
+        host = urlparse(url).hostname
+        if host not in self._hosts:
+            self._hosts[host] = asyncio.Semaphore(self._connections_per_host)
+        return self._hosts[host]
+
+    @staticmethod
+    def flow() -> asyncio.Lock:
+        """ Token of one transfer, passed along with every chunk it consumes """
+        return asyncio.Lock()
+
+    async def _take(self, size: int):
+        async with self._lock:
+            while self._rate:
+                now = time.monotonic()
+                self._tokens = min(self._rate * self._burst, self._tokens + (now - self._updated) * self._rate)
+                self._updated = now
+                if self._tokens >= 0:
+                    # chunks larger than the burst leave a debt the next waiter sleeps off
+                    self._tokens -= size
+                    return
+                # short sleeps, so that a new rate applies to the transfers already waiting
+                await asyncio.sleep(min(0.25, -self._tokens / self._rate))
+
+    async def consume(self, size: int, flow: asyncio.Lock = None):
+        """ Wait until `size` more bytes fit the budget """
+        if not self._rate:
+            return
+        if flow is None:
+            return await self._take(size)
+        # chunks of one flow queue behind each other first
+        async with flow:
+            await self._take(size)
+
+    async def follow_schedule(self, path: str, interval: float = 30):
+        """ Apply the rate `path` schedules for the current time of day until cancelled, reading the file again
+            when it changes or on SIGHUP. Without an entry the rate set at startup stays in effect """
+        default_rate = self._rate
+        reload = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        try:
+            loop.add_signal_handler(signal.SIGHUP, reload.set)
+        except (AttributeError, NotImplementedError):
+            # no SIGHUP on windows
+            pass
+        (schedule, modified) = ([], None)
+        try:
+            while True:
+                try:
+                    if reload.is_set() or os.path.getmtime(path) != modified:
+                        modified = os.path.getmtime(path)
+                        with open(path) as f:
+                            schedule = parse_schedule(f.read())
+                        logger.info(f'loaded bandwidth schedule {path} with {len(schedule)} entries')
+                except (OSError, ValueError) as ex:
+                    logger.warning(f'failed to read bandwidth schedule {path}: {ex}')
+                reload.clear()
+                now = time.localtime()
+                rate = scheduled_rate(schedule, now.tm_hour * 60 + now.tm_min)
+                self.rate = default_rate if rate is None else rate
+                try:
+                    await asyncio.wait_for(reload.wait(), interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            if hasattr(signal, 'SIGHUP'):
+                loop.remove_signal_handler(signal.SIGHUP)
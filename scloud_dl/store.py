@@ -0,0 +1,108 @@
+import logging
+import os
+from logging import Logger
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:
+    # windows, where the store is only shared by the profiles of one process
+    fcntl = None
+
+from .tagging import mp3_duration
+
+logger: Logger = logging.getLogger(__name__)
+
+
+class TrackStore:
+    """ Content addressed track files, stored once under `{root}/{shard}/{track id}.{extension}`
+        and exposed in per-profile directories through hard links, or symbolic links across filesystems """
+
+    # seconds a file downloaded by earlier versions may differ from the duration of the track to be adopted
+    ADOPT_TOLERANCE: float = 2
+
+    def __init__(self, root: str):
+        self._root = root
+
+    def object_path(self, track_id: int, extension: str) -> str:
+        return f'{self._root}/{track_id % 256:02x}/{track_id}.{extension}'
+
+    def has(self, track_id: int, extension: str) -> bool:
+        return os.path.exists(self.object_path(track_id, extension))
+
+    def prepare(self, object_path: str):
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+
+    def try_lock(self, object_path: str) -> Optional[int]:
+        """ Lock `object_path` against other processes storing it, ex. workers sharing a work queue, returning
+            the lock to release with `unlock`, or None while another process holds it """
+        self.prepare(object_path)
+        fd = os.open(f'{object_path}.lock', os.O_RDWR | os.O_CREAT, 0o644)
+        if fcntl:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                return None
+        return fd
+
+    @staticmethod
+    def unlock(lock: Optional[int]):
+        if lock is None:
+            return
+        # the lock file stays, removing it would let two processes lock different files of the same name
+        if fcntl:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+        os.close(lock)
+
+    def adopt(self, object_path: str, view_dir: str, title: str, duration: Optional[int]) -> bool:
+        """ Take an mp3 file downloaded straight into `view_dir` as `{title}.mp3` by earlier versions into the
+            store as `object_path`, so that it is linked rather than downloaded again. Only a complete file of the
+            track's `duration` in milliseconds is taken, not one cut short by a crash or of another track of the
+            same title. False when there is none """
+        extension = os.path.splitext(object_path)[1]
+        path = f'{view_dir}/{title.replace("/", "")}{extension}'
+        # a file already linked elsewhere belongs to the store
+        if (extension != '.mp3' or not duration or os.path.islink(path) or not os.path.isfile(path)
+                or os.stat(path).st_nlink > 1):
+            return False
+        seconds = mp3_duration(path)
+        if seconds is None or abs(seconds - duration / 1000) > self.ADOPT_TOLERANCE:
+            logger.info(f'not moving {path} into the store, it plays {seconds or 0:.0f}s of {duration / 1000:.0f}s')
+            return False
+        self.prepare(object_path)
+        try:
+            os.link(path, object_path)
+        except OSError:
+            try:
+                # no hard links here, `link` puts a symbolic one in its place
+                os.replace(path, object_path)
+            except OSError:
+                return False
+        logger.info(f'moved {path} into the store as {object_path}')
+        return True
+
+    @staticmethod
+    def _is_link_to(path: str, object_path: str) -> bool:
+        return os.path.exists(path) and os.path.samefile(path, object_path)
+
+    def _link_file(self, object_path: str, path: str):
+        try:
+            os.link(object_path, path)
+        except OSError:
+            os.symlink(os.path.relpath(object_path, os.path.dirname(path)), path)
+
+    def link(self, object_path: str, view_dir: str, title: str, track_id: int) -> str:
+        """ Expose `object_path` in `view_dir` as `{title}.{extension}`, suffixed with the track id when another
+            track already holds that name """
+        extension = os.path.splitext(object_path)[1]
+        os.makedirs(view_dir, exist_ok=True)
+        name = title.replace('/', '')
+        for path in (f'{view_dir}/{name}{extension}', f'{view_dir}/{name} [{track_id}]{extension}'):
+            if self._is_link_to(path, object_path):
+                return path
+            if not os.path.lexists(path):
+                self._link_file(object_path, path)
+                logger.debug(f'linked {path} to {object_path}')
+                return path
+        raise FileExistsError(f'cannot link {object_path} into {view_dir}, {path} belongs to another file')
@@ -0,0 +1,60 @@
+import logging
+import os
+import sqlite3
+import time
+from dataclasses import dataclass
+from logging import Logger
+from typing import Optional
+
+logger: Logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SyncCursor:
+    """ Tracks the newest collection item seen during a listing and where the previous sync stopped """
+    since: Optional[str] = None
+    newest: Optional[str] = None
+    # False when items of the listing could not be expanded, so that the next sync lists them again
+    complete: bool = True
+
+    def is_new(self, created_at: str) -> bool:
+        # collection items come back newest first with ISO-8601 UTC timestamps, which order lexicographically
+        if self.newest is None or created_at > self.newest:
+            self.newest = created_at
+        return self.since is None or created_at > self.since
+
+
+class SyncWatermarks:
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS watermarks (
+            profile TEXT NOT NULL,
+            collection_type TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            synced_at REAL NOT NULL,
+            PRIMARY KEY (profile, collection_type)
+        )"""
+
+    def __init__(self, db_path: str = './cache/sync.db'):
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._connection = sqlite3.connect(db_path)
+        self._connection.execute(self.SCHEMA)
+        self._connection.commit()
+
+    def get(self, profile: str, collection_type: str) -> Optional[str]:
+        row = self._connection.execute(
+            'SELECT created_at FROM watermarks WHERE profile = ? AND collection_type = ?',
+            (profile, collection_type)).fetchone()
+        return row[0] if row else None
+
+    def set(self, profile: str, collection_type: str, created_at: str):
+        with self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO watermarks VALUES (?, ?, ?, ?)',
+                (profile, collection_type, created_at, time.time()))
+        logger.info(f'{profile} {collection_type} synced up to {created_at}')
+
+    def cursor(self, profile: str, collection_type: str, full_sync: bool = False) -> SyncCursor:
+        return SyncCursor(since=None if full_sync else self.get(profile, collection_type))
+
+    def close(self):
+        self._connection.close()
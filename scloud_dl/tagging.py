@@ -0,0 +1,106 @@
+import logging
+import mimetypes
+import os
+import struct
+from logging import Logger
+from typing import Optional
+
+from . import models
+
+logger: Logger = logging.getLogger(__name__)
+
+# tag names, as understood by ffmpeg, to their ID3v2.4 text frames
+ID3_FRAMES: dict = {
+    'title': 'TIT2',
+    'artist': 'TPE1',
+    'album': 'TALB',
+    'genre': 'TCON',
+    'date': 'TDRC',
+    'publisher': 'TPUB',
+    'isrc': 'TSRC',
+}
+
+
+def track_tags(sc_track: models.Track) -> dict:
+    """ Tags of a listed track, preferring its publisher metadata over the uploader """
+    publisher = sc_track.publisher_metadata
+    user = sc_track.user
+    tags = {
+        'title': sc_track.title,
+        'artist': (publisher and publisher.artist) or (user and user.username),
+        'album': publisher and (publisher.album_title or publisher.release_title),
+        'genre': sc_track.genre,
+        'date': (sc_track.release_date or sc_track.display_date or '')[:10],
+        'publisher': publisher and publisher.publisher,
+        'isrc': publisher and publisher.isrc,
+        'url': sc_track.permalink_url,
+    }
+    return {name: value for (name, value) in tags.items() if value}
+
+
+def cover_url(sc_track: models.Track) -> Optional[str]:
+    """ Artwork of the track, else the uploader avatar, at the 500x500 size """
+    url = sc_track.artwork_url or (sc_track.user and sc_track.user.avatar_url)
+    return url.replace('-large.', '-t500x500.') if url else None
+
+
+def image_mime_type(path: str) -> str:
+    return mimetypes.guess_type(path)[0] or 'image/jpeg'
+
+
+def _syncsafe(size: int) -> bytes:
+    return bytes(((size >> 21) & 0x7f, (size >> 14) & 0x7f, (size >> 7) & 0x7f, size & 0x7f))
+
+
+def _frame(frame_id: str, payload: bytes) -> bytes:
+    return frame_id.encode('ascii') + _syncsafe(len(payload)) + b'\x00\x00' + payload
+
+
+def id3_tag(tags: dict, artwork: Optional[bytes] = None, artwork_mime: str = 'image/jpeg') -> bytes:
+    """ ID3v2.4 tag with utf-8 text frames and the artwork as front cover, written ahead of the mpeg frames """
+    frames = [_frame(frame_id, b'\x03' + tags[name].encode('utf-8'))
+              for (name, frame_id) in ID3_FRAMES.items() if tags.get(name)]
+    if tags.get('url'):
+        frames.append(_frame('WOAF', tags['url'].encode('latin-1', errors='ignore')))
+    if artwork:
+        # utf-8 description, mime type, front cover picture type and an empty description
+        frames.append(_frame('APIC', b'\x03' + artwork_mime.encode('ascii') + b'\x00\x03\x00' + artwork))
+    body = b''.join(frames)
+    return b'ID3' + struct.pack('>BBB', 4, 0, 0) + _syncsafe(len(body)) + body
+
+
+# layer III bitrates in kbit/s by bitrate index, for mpeg 1 and for mpeg 2 and 2.5
+MP3_BITRATES: tuple = (
+    (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160))
+# sample rates by version bits, mpeg 2.5, reserved, mpeg 2 and mpeg 1
+MP3_SAMPLE_RATES: tuple = ((11025, 12000, 8000), None, (22050, 24000, 16000), (44100, 48000, 32000))
+
+
+def mp3_duration(path: str) -> Optional[float]:
+    """ Seconds of audio in the complete layer III frames of an mp3 file, counted up to the first frame that is
+        cut short or out of sync, or None when it does not start with one """
+    length = os.path.getsize(path)
+    seconds = 0.0
+    with open(path, 'rb') as f:
+        header = f.read(10)
+        offset = 0
+        if header[:3] == b'ID3' and len(header) == 10:
+            offset = 10 + ((header[6] << 21) | (header[7] << 14) | (header[8] << 7) | header[9])
+        while offset + 4 <= length:
+            f.seek(offset)
+            (b1, b2, b3) = f.read(3)
+            version = (b2 >> 3) & 3
+            (bitrate_index, rate_index) = (b3 >> 4, (b3 >> 2) & 3)
+            if (b1 != 0xff or b2 & 0xe0 != 0xe0 or version == 1 or (b2 >> 1) & 3 != 1
+                    or bitrate_index in (0, 15) or rate_index == 3):
+                break
+            mpeg1 = version == 3
+            sample_rate = MP3_SAMPLE_RATES[version][rate_index]
+            frame_samples = 1152 if mpeg1 else 576
+            size = frame_samples // 8 * MP3_BITRATES[0 if mpeg1 else 1][bitrate_index] * 1000 // sample_rate + ((b3 >> 1) & 1)
+            if offset + size > length:
+                break
+            seconds += frame_samples / sample_rate
+            offset += size
+    return seconds or None
@@ -0,0 +1,155 @@
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import nullcontext
+from logging import Logger
+
+from aiohttp import TraceConfig
+
+logger: Logger = logging.getLogger(__name__)
+
+# id of the track the current task works on, attached to the spans it records
+current_track: 'contextvars.ContextVar[int]' = contextvars.ContextVar('current_track', default=None)
+
+_DISABLED = nullcontext()
+
+
+class _Span:
+    __slots__ = ('_tracer', '_name', '_category', '_args', '_started')
+
+    def __init__(self, tracer: 'Tracer', name: str, category: str, args: dict):
+        self._tracer = tracer
+        self._name = name
+        self._category = category
+        self._args = args
+
+    def __enter__(self):
+        self._started = self._tracer.now()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self._args['error'] = exc_type.__name__
+        self._tracer.complete(self._name, self._category, self._started, self._tracer.now(), **self._args)
+
+
+class Tracer:
+    """ Opt-in timeline of the stages each track goes through, streamed to a Chrome trace-event file that
+        Perfetto or chrome://tracing open. Spans land on the row of the asyncio task, or thread, recording them,
+        and queue waits, which overlap freely, are recorded as async events keyed by track id """
+
+    def __init__(self):
+        self.enabled: bool = False
+        self._file = None
+        self._origin = time.perf_counter()
+        self._pid = os.getpid()
+        self._tids: 'dict[str, int]' = {}
+        self._http_ended: 'dict[tuple, float]' = {}
+
+    def start(self, path: str):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._file = open(path, 'w')
+        self._file.write('[\n')
+        self._emit({'name': 'process_name', 'ph': 'M', 'pid': self._pid, 'args': {'name': f'scloud_dl {self._pid}'}},
+                   first=True)
+        self.enabled = True
+        logger.info(f'tracing to {path}')
+
+    def close(self):
+        if self._file is None:
+            return
+        self.enabled = False
+        self._file.write('\n]\n')
+        self._file.close()
+        self._file = None
+
+    def now(self) -> float:
+        """ Microseconds since the tracer was created, the time unit of trace events """
+        return (time.perf_counter() - self._origin) * 1e6
+
+    def _emit(self, event: dict, first: bool = False):
+        self._file.write(('' if first else ',\n') + json.dumps(event))
+
+    def _tid(self) -> int:
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        name = task.get_name() if task else threading.current_thread().name
+        tid = self._tids.get(name)
+        if tid is None:
+            tid = self._tids[name] = len(self._tids) + 1
+            self._emit({'name': 'thread_name', 'ph': 'M', 'pid': self._pid, 'tid': tid, 'args': {'name': name}})
+        return tid
+
+    def _args(self, args: dict) -> dict:
+        track_id = current_track.get()
+        if track_id is not None and 'track_id' not in args:
+            args['track_id'] = track_id
+        return args
+
+    def span(self, name: str, category: str, **args):
+        """ Context manager recording the time spent in its block """
+        if not self.enabled:
+            return _DISABLED
+        return _Span(self, name, category, args)
+
+    def complete(self, name: str, category: str, started: float, ended: float, **args):
+        if not self.enabled:
+            return
+        # rounding both ends alike keeps back to back spans from overlapping
+        (started, ended) = (round(started, 1), round(ended, 1))
+        self._emit({'name': name, 'cat': category, 'ph': 'X', 'ts': started,
+                    'dur': round(ended - started, 1), 'pid': self._pid, 'tid': self._tid(), 'args': self._args(args)})
+
+    def begin(self, name: str, category: str, key, **args):
+        """ Start an async span, ex. a track entering a queue, ended by `end` with the same `key` """
+        if self.enabled:
+            self._emit({'name': name, 'cat': category, 'ph': 'b', 'id': str(key), 'ts': round(self.now(), 1),
+                        'pid': self._pid, 'tid': self._tid(), 'args': args})
+
+    def end(self, name: str, category: str, key, **args):
+        if self.enabled:
+            self._emit({'name': name, 'cat': category, 'ph': 'e', 'id': str(key), 'ts': round(self.now(), 1),
+                        'pid': self._pid, 'tid': self._tid(), 'args': args})
+
+    def trace_config(self) -> TraceConfig:
+        """ aiohttp trace hooks recording every request attempt, and the backoff slept by `RetryClient`
+            between two attempts. Installed ahead of the rate limiter, so requests contain their wait for a token """
+        trace_config = TraceConfig()
+
+        def attempt_of(context) -> int:
+            return (context.trace_request_ctx or {}).get('current_attempt', 1)
+
+        async def on_request_start(session, context, params):
+            context.started = self.now()
+            key = (id(asyncio.current_task()), str(params.url))
+            ended = self._http_ended.pop(key, None)
+            if ended is not None and attempt_of(context) > 1:
+                self.complete('retry_sleep', 'http', ended, context.started, attempt=attempt_of(context))
+
+        def on_finished(context, params, retryable: bool, **args):
+            ended = self.now()
+            self.complete(f'{params.method} {params.url.path}', 'http', context.started, ended,
+                          host=params.url.host, attempt=attempt_of(context), **args)
+            if retryable:
+                self._http_ended[(id(asyncio.current_task()), str(params.url))] = ended
+
+        async def on_request_end(session, context, params):
+            status = params.response.status
+            on_finished(context, params, status >= 400, status=status)
+
+        async def on_request_exception(session, context, params):
+            on_finished(context, params, True, error=type(params.exception).__name__)
+
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_request_end.append(on_request_end)
+        trace_config.on_request_exception.append(on_request_exception)
+        return trace_config
+
+
+TRACER = Tracer()
@@ -0,0 +1,67 @@
+from fnmatch import fnmatch
+import logging
+from logging import Logger
+from typing import List, Optional
+
+from .models import Transcoding
+
+logger: Logger = logging.getLogger(__name__)
+
+# `protocol:preset` patterns, most preferred first
+DEFAULT_PREFERENCES: 'List[str]' = [
+    'progressive:mp3_standard',
+    'hls:mp3_standard',
+    'progressive:mp3_*',
+    'hls:mp3_*',
+    'hls:opus_*',
+]
+
+# protocols the downloader can fetch, others like `encrypted-hls` are never selected
+PROTOCOLS: set = {'hls', 'progressive'}
+
+CODECS: dict = {
+    'audio/mpeg': 'mp3',
+    'audio/ogg; codecs="opus"': 'opus',
+    'audio/mp4; codecs="mp4a.40.2"': 'aac',
+}
+
+EXTENSIONS: dict = {
+    'mp3': 'mp3',
+    'opus': 'opus',
+    'aac': 'm4a',
+}
+
+
+def codec_of(mime_type: str) -> str:
+    if mime_type in CODECS:
+        return CODECS[mime_type]
+    return 'opus' if 'opus' in mime_type else mime_type.split('/')[-1].split(';')[0]
+
+
+def extension_of(codec: str) -> str:
+    return EXTENSIONS.get(codec, codec)
+
+
+def output_codec(mime_type: str, output_mode: str, output_format: str) -> str:
+    """ Codec of the file written for a source of `mime_type` """
+    return output_format if output_mode == 'encode' else codec_of(mime_type)
+
+
+def _matches(transcoding: Transcoding, preference: str) -> bool:
+    (protocol, _, preset) = preference.partition(':')
+    return fnmatch(transcoding.format.protocol, protocol or '*') and fnmatch(transcoding.preset, preset or '*')
+
+
+def select_transcoding(transcodings: 'List[Transcoding]', preferences: 'List[str]') -> Optional[Transcoding]:
+    """ Pick the first full-length transcoding matching the preference order, falling back to the first full-length
+        one the downloader supports. None when there is none, ex. only 30s previews or encrypted streams """
+    playable = [transcoding for transcoding in transcodings or ()
+                if not transcoding.snipped and transcoding.format.protocol in PROTOCOLS]
+    for preference in preferences:
+        for transcoding in playable:
+            if _matches(transcoding, preference):
+                return transcoding
+    if playable:
+        logger.debug(f'no transcoding matches {preferences}, falling back to the first available')
+        return playable[0]
+    return None
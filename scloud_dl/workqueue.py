@@ -0,0 +1,183 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import time
+from dataclasses import asdict
+from logging import Logger
+from typing import Callable, Iterable, Optional, Union
+
+from . import Track
+from .tracing import TRACER
+
+logger: Logger = logging.getLogger(__name__)
+
+
+class WorkQueue:
+    """ SQLite backed job queue shared by processes on one machine or on several nodes mounting the same
+        filesystem. A coordinator writes resolved tracks as jobs, workers claim them under leases that a
+        heartbeat keeps alive, and jobs whose lease expired, ex. after a worker crashed, are handed out again
+        up to `max_attempts` times. It exposes the same interface as `FairScheduler`, so the downloader and
+        the profile syncs run unchanged on top of it """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            lane TEXT NOT NULL,
+            track_id INTEGER NOT NULL,
+            track TEXT NOT NULL,
+            priority REAL NOT NULL,
+            state TEXT NOT NULL DEFAULT 'pending',
+            owner TEXT,
+            lease_expires REAL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            UNIQUE (lane, track_id)
+        );
+        CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, priority, id);
+        CREATE TABLE IF NOT EXISTS lanes (
+            lane TEXT PRIMARY KEY,
+            open INTEGER NOT NULL,
+            runs INTEGER NOT NULL DEFAULT 1
+        )"""
+
+    def __init__(self, db_path: str, lanes: Iterable[str] = (), maxsize: int = 128, key: Callable = None,
+                 lease_seconds: float = 120, max_attempts: int = 3, poll_interval: float = 1):
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        # no WAL journal, it relies on shared memory that network filesystems do not provide
+        self._connection = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+        self._connection.executescript(self.SCHEMA)
+        self._maxsize = maxsize
+        self._key = key
+        self._lease_seconds = lease_seconds
+        self._max_attempts = max_attempts
+        self._poll_interval = poll_interval
+        self.owner: str = f'{socket.gethostname()}:{os.getpid()}'
+        # job ids of the tracks handed out by `get` by track identity, and of the jobs leased until settled
+        self._handed: 'dict[int, int]' = {}
+        self._leases: 'set[int]' = set()
+        # lanes left closed by a previous run on the same database do not count until a coordinator opens them
+        # again, or this process was handed a job
+        self._lanes_opened = False
+        with self._transaction() as connection:
+            self._runs = self._lane_states()[0]
+            connection.executemany(
+                'INSERT INTO lanes (lane, open) VALUES (?, 1) ON CONFLICT (lane) DO UPDATE SET open = 1, runs = runs + 1',
+                [(lane,) for lane in lanes])
+
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock upfront, so that two workers never claim the same job
+        self._connection.execute('BEGIN IMMEDIATE')
+        return self._connection
+
+    def _lane_states(self) -> tuple:
+        """ Number of times lanes were opened so far, and number of lanes open now """
+        return self._connection.execute('SELECT COALESCE(SUM(runs), 0), COALESCE(SUM(open), 0) FROM lanes').fetchone()
+
+    def _count(self, *states: str) -> int:
+        return self._connection.execute(
+            f'SELECT COUNT(*) FROM jobs WHERE state IN ({",".join("?" * len(states))})', states).fetchone()[0]
+
+    def qsize(self) -> int:
+        return self._count('pending')
+
+    async def put(self, lane: str, track: Track):
+        """ Add a job for `track`, waiting while `maxsize` jobs are pending so that stream urls do not expire
+            in the queue. A track already queued for `lane` is not added again, but a job that nobody works on
+            takes its fresh stream url and priority """
+        while self._count('pending') >= self._maxsize:
+            await asyncio.sleep(self._poll_interval)
+        priority = self._key(track) if self._key else 0
+        with self._transaction() as connection:
+            connection.execute(
+                'INSERT INTO jobs (lane, track_id, track, priority) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (lane, track_id) DO UPDATE SET track = excluded.track, priority = excluded.priority, '
+                "state = CASE WHEN state = 'failed' THEN 'pending' ELSE state END, "
+                "attempts = CASE WHEN state = 'failed' THEN 0 ELSE attempts END "
+                "WHERE state IN ('pending', 'failed') OR (state = 'leased' AND lease_expires < ?)",
+                (lane, track.id, json.dumps(asdict(track)), priority, time.time()))
+        TRACER.begin('queued', 'queue', track.id, lane=lane)
+
+    async def close(self, lane: str):
+        """ Mark `lane` as exhausted, workers exit once every lane is closed and no job is left """
+        with self._transaction() as connection:
+            connection.execute('UPDATE lanes SET open = 0 WHERE lane = ?', (lane,))
+
+    def _claim(self) -> Optional[tuple]:
+        now = time.time()
+        with self._transaction() as connection:
+            expired = connection.execute(
+                "UPDATE jobs SET state = 'failed', owner = NULL "
+                "WHERE state = 'leased' AND lease_expires < ? AND attempts >= ?", (now, self._max_attempts)).rowcount
+            if expired:
+                logger.warning(f'{expired} jobs failed after {self._max_attempts} expired leases')
+            job = connection.execute(
+                "SELECT id, lane, track FROM jobs WHERE state = 'pending' OR (state = 'leased' AND lease_expires < ?) "
+                'ORDER BY priority, id LIMIT 1', (now,)).fetchone()
+            if job:
+                connection.execute(
+                    "UPDATE jobs SET state = 'leased', owner = ?, lease_expires = ?, attempts = attempts + 1 WHERE id = ?",
+                    (self.owner, now + self._lease_seconds, job[0]))
+        return job
+
+    def _finished(self) -> bool:
+        (runs, open_lanes) = self._lane_states()
+        if open_lanes or runs > self._runs:
+            self._lanes_opened = True
+        # lanes closed before this process started belong to a previous run
+        return self._lanes_opened and not open_lanes and not self._count('pending', 'leased')
+
+    async def get(self):
+        """ Claim the next `(lane, track)` job, or None once every lane is closed and every job is finished """
+        while True:
+            job = self._claim()
+            if job:
+                (job_id, lane, track) = job
+                track = Track(**json.loads(track))
+                self._handed[id(track)] = job_id
+                self._lanes_opened = True
+                self._leases.add(job_id)
+                TRACER.end('queued', 'queue', track.id)
+                return (lane, track)
+            if self._finished():
+                return None
+            await asyncio.sleep(self._poll_interval)
+
+    def _settle(self, job_id: int, success: bool):
+        self._leases.discard(job_id)
+        with self._transaction() as connection:
+            if success:
+                settled = connection.execute(
+                    "UPDATE jobs SET state = 'done', lease_expires = NULL WHERE id = ? AND owner = ?",
+                    (job_id, self.owner)).rowcount
+            else:
+                settled = connection.execute(
+                    "UPDATE jobs SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                    'owner = NULL, lease_expires = NULL WHERE id = ? AND owner = ?',
+                    (self._max_attempts, job_id, self.owner)).rowcount
+        if not settled:
+            logger.warning(f'lease on job {job_id} was lost before it finished')
+
+    def task_done(self, scheduled: tuple, stored: Union[bool, asyncio.Future]):
+        """ Settle the lease of a job handed out by `get` once `stored` tells whether the track was stored """
+        job_id = self._handed.pop(id(scheduled[1]))
+        if isinstance(stored, asyncio.Future):
+            stored.add_done_callback(
+                lambda future: self._settle(job_id, not future.cancelled() and not future.exception() and future.result()))
+        else:
+            self._settle(job_id, stored)
+
+    async def heartbeat(self):
+        """ Extend the leases held by this process until cancelled """
+        while True:
+            await asyncio.sleep(self._lease_seconds / 3)
+            if not self._leases:
+                continue
+            with self._transaction() as connection:
+                connection.executemany(
+                    'UPDATE jobs SET lease_expires = ? WHERE id = ? AND owner = ?',
+                    [(time.time() + self._lease_seconds, job_id, self.owner) for job_id in self._leases])
+
+    def close_connection(self):
+        self._connection.close()
@@ -0,0 +1,104 @@
+import asyncio
+
+from scloud_dl import Track
+from scloud_dl.checkpoint import Checkpoint
+from scloud_dl.client import Configurations
+from scloud_dl.downloader import TrackDownloader
+from scloud_dl.store import TrackStore
+
+SOURCE = 'progressive:audio/mpeg:/media/1.128.mp3'
+
+
+def part(tmp_path, data: bytes) -> str:
+    path = tmp_path / 'track.mp3.part'
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_resume_truncates_to_the_saved_offset(tmp_path):
+    part_path = part(tmp_path, b'tag' + b'x' * 10)
+    checkpoint = Checkpoint(part_path, SOURCE)
+    checkpoint.save(0, 3, header=3)
+    checkpoint.save(2, 8)
+    # bytes written after the last checkpoint may not have been flushed whole
+    resumed = Checkpoint(part_path, SOURCE).load()
+    assert (resumed.segments, resumed.offset, resumed.header) == (2, 8, 3)
+    with open(part_path, 'rb') as f:
+        assert f.read() == b'tagxxxxx'
+
+
+def test_another_source_starts_over(tmp_path):
+    part_path = part(tmp_path, b'x' * 10)
+    Checkpoint(part_path, SOURCE).save(1, 10)
+    resumed = Checkpoint(part_path, 'progressive:audio/mpeg:/media/1.64.mp3').load()
+    assert (resumed.segments, resumed.offset, resumed.header) == (0, 0, 0)
+    with open(part_path, 'rb') as f:
+        assert f.read() == b''
+
+
+def test_part_shorter_than_the_checkpoint_starts_over(tmp_path):
+    part_path = part(tmp_path, b'x' * 10)
+    Checkpoint(part_path, SOURCE).save(1, 10)
+    part(tmp_path, b'x' * 4)
+    assert Checkpoint(part_path, SOURCE).load().offset == 0
+
+
+def test_unreadable_checkpoint_starts_over(tmp_path):
+    part_path = part(tmp_path, b'x' * 10)
+    (tmp_path / 'track.mp3.part.json').write_text('{')
+    assert Checkpoint(part_path, SOURCE).load().offset == 0
+
+
+def test_remove_forgets_progress(tmp_path):
+    part_path = part(tmp_path, b'x' * 10)
+    checkpoint = Checkpoint(part_path, SOURCE)
+    checkpoint.save(1, 10)
+    checkpoint.remove()
+    assert not (tmp_path / 'track.mp3.part.json').exists()
+
+
+class Response:
+    def __init__(self, body: bytes, status: int):
+        self.status = status
+        self.content = self
+        self._body = body
+
+    async def iter_chunked(self, size: int):
+        for start in range(0, len(self._body), size):
+            yield self._body[start:start + size]
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+
+class Session:
+    """ Serves `media`, honouring byte ranges, and records the range of every request """
+
+    def __init__(self, media: bytes):
+        self.media = media
+        self.ranges = []
+
+    def get(self, url: str, headers: dict = None, **kwargs) -> Response:
+        requested = (headers or {}).get('Range')
+        self.ranges.append(requested)
+        if requested:
+            return Response(self.media[int(requested[len('bytes='):-1]):], 206)
+        return Response(self.media, 200)
+
+
+def test_resumed_download_skips_the_tag_header_in_its_range(tmp_path):
+    session = Session(b'0123456789')
+    downloader = TrackDownloader(session, Configurations('me', 'dl', ['likes']), TrackStore(str(tmp_path / '.store')))
+    track = Track(title='track', url='https://cdn/media/1.128.mp3?Expires=1', protocol='progressive', id=1)
+    file_path = str(tmp_path / 'track.mp3')
+    part_path = part(tmp_path, b'tag01234')
+    checkpoint = Checkpoint(part_path, downloader._source_of(track))
+    checkpoint.save(0, 3, header=3)
+    checkpoint.save(0, 8)
+    asyncio.run(downloader._download_stream(track, file_path, b'tag'))
+    assert session.ranges == ['bytes=5-']
+    with open(file_path, 'rb') as f:
+        assert f.read() == b'tag0123456789'
@@ -0,0 +1,35 @@
+import pytest
+
+from scloud_dl.hls import Segment, parse_playlist
+
+PLAYLIST_URL = 'https://cdn/media/1/playlist.m3u8?Policy=signed'
+
+
+def test_segments_resolve_against_the_playlist_url():
+    segments = parse_playlist(
+        '#EXTM3U\n#EXT-X-TARGETDURATION:10\n#EXTINF:9.5,\n0.mp3\n#EXTINF:4,\nhttps://other/1.mp3\n#EXT-X-ENDLIST\n',
+        PLAYLIST_URL)
+    assert segments == [Segment(index=0, url='https://cdn/media/1/0.mp3', duration=9.5),
+                        Segment(index=1, url='https://other/1.mp3', duration=4.0)]
+
+
+def test_map_is_fetched_ahead_of_the_segments():
+    segments = parse_playlist('#EXTM3U\n#EXT-X-MAP:URI="init.mp4"\n#EXTINF:10,\n0.m4s\n', PLAYLIST_URL)
+    assert [segment.url for segment in segments] == ['https://cdn/media/1/init.mp4', 'https://cdn/media/1/0.m4s']
+    assert [segment.index for segment in segments] == [0, 1]
+
+
+def test_unencrypted_key_is_ignored():
+    segments = parse_playlist('#EXTM3U\n#EXT-X-KEY:METHOD=NONE\n#EXTINF:10,\n0.mp3\n', PLAYLIST_URL)
+    assert len(segments) == 1
+
+
+@pytest.mark.parametrize('playlist', [
+    '#EXTM3U\n#EXT-X-KEY:METHOD=AES-128,URI="key"\n#EXTINF:10,\n0.mp3\n',
+    '#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH=128000\nmedia.m3u8\n',
+    '#EXTM3U\n#EXTINF:10,\n0.m4s\n#EXT-X-MAP:URI="init.mp4"\n#EXTINF:10,\n1.m4s\n',
+    '#EXTM3U\n#EXT-X-MAP:BYTERANGE="100@0"\n#EXTINF:10,\n0.m4s\n',
+], ids=['encrypted', 'master', 'map between segments', 'map without uri'])
+def test_unsupported_playlists_are_rejected(playlist):
+    with pytest.raises(ValueError):
+        parse_playlist(playlist, PLAYLIST_URL)
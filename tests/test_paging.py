@@ -0,0 +1,81 @@
+import asyncio
+from urllib.parse import parse_qsl, urlparse
+
+from scloud_dl.paging import Pager
+
+BASE = 'https://api/likes?limit=2'
+
+
+def query(href: str) -> dict:
+    return dict(parse_qsl(urlparse(href).query))
+
+
+def offset_api(items: int, fetched: list, step: int = 2):
+    """ Collection of `items` numbers listed `step` at a time, next hrefs carrying the offset of the next page """
+    async def fetch(href: str):
+        fetched.append(href)
+        await asyncio.sleep(0)
+        offset = int(query(href).get('offset', 0))
+        page = list(range(offset, min(offset + step, items)))
+        next_href = f'{BASE}&offset={offset + step}' if offset + step < items else None
+        return (page, next_href)
+    return fetch
+
+
+def collect(pager: Pager, href: str = BASE) -> list:
+    async def run():
+        return [item async for page in pager.pages(href) for item in page]
+    return asyncio.run(run())
+
+
+def test_offset_pages_are_prefetched_in_order():
+    fetched = []
+    assert collect(Pager(offset_api(7, fetched), prefetch=3)) == list(range(7))
+    offsets = [int(query(href).get('offset', 0)) for href in fetched]
+    # predicted past the end of the collection, each page requested once
+    assert offsets[:4] == [0, 2, 4, 6]
+    assert len(offsets) == len(set(offsets))
+
+
+def test_mismatched_predictions_are_dropped():
+    fetched = []
+    pages = {0: ([0, 1], f'{BASE}&offset=2'), 2: ([2, 3], f'{BASE}&offset=10'), 10: ([10], None)}
+
+    async def fetch(href: str):
+        fetched.append(href)
+        await asyncio.sleep(0)
+        # predicted offsets the api never hands out come back as empty pages pointing elsewhere
+        return pages.get(int(query(href).get('offset', 0)), ([-1], f'{BASE}&offset=99'))
+
+    assert collect(Pager(fetch, prefetch=2)) == [0, 1, 2, 3, 10]
+    assert f'{BASE}&offset=10' in fetched
+
+
+def test_cursor_hrefs_chain_one_page_ahead():
+    cursors = {None: ('a', [1]), 'a': ('b', [2]), 'b': (None, [3])}
+    in_flight = [0, 0]
+
+    async def fetch(href: str):
+        in_flight[0] += 1
+        in_flight[1] = max(in_flight)
+        await asyncio.sleep(0)
+        in_flight[0] -= 1
+        (next_cursor, page) = cursors[query(href).get('cursor')]
+        return (page, f'{BASE}&cursor={next_cursor}' if next_cursor else None)
+
+    assert collect(Pager(fetch, prefetch=4)) == [1, 2, 3]
+    assert in_flight[1] == 1
+
+
+def test_no_prefetch_requests_a_page_once_asked_for():
+    fetched = []
+
+    async def run():
+        pages = Pager(offset_api(6, fetched), prefetch=0).pages(BASE)
+        await pages.__anext__()
+        await asyncio.sleep(0.01)
+        requested = len(fetched)
+        await pages.aclose()
+        return requested
+
+    assert asyncio.run(run()) == 1
@@ -0,0 +1,13 @@
+import subprocess
+import sys
+
+# only needed by the browser login or by ffmpeg remux/encode jobs, never on a plain sync
+LAZY_MODULES = ('selenium', 'undetected_chromedriver', 'ffmpeg', 'requests', 'aiocsv')
+
+
+def test_cli_import_leaves_heavy_dependencies_unloaded():
+    process = subprocess.run(
+        [sys.executable, '-c', 'import sys, scloud_dl.__main__; print("\\n".join(sys.modules))'],
+        capture_output=True, text=True, check=True)
+    loaded = set(process.stdout.split())
+    assert [module for module in LAZY_MODULES if module in loaded] == []
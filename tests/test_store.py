@@ -0,0 +1,43 @@
+from scloud_dl.store import TrackStore
+
+
+def test_lock_excludes_other_holders_until_released(tmp_path):
+    store = TrackStore(str(tmp_path / '.store'))
+    object_path = store.object_path(1, 'mp3')
+    lock = store.try_lock(object_path)
+    assert lock is not None
+    assert store.try_lock(object_path) is None
+    store.unlock(lock)
+    lock = store.try_lock(object_path)
+    assert lock is not None
+    store.unlock(lock)
+
+
+def mp3(frames: int) -> bytes:
+    # mpeg 1 layer III frames of 128 kbit/s at 44.1 kHz, 1152 samples each
+    return (b'\xff\xfb\x90\x00' + bytes(413)) * frames
+
+
+def test_adopted_file_is_linked_in_place(tmp_path):
+    store = TrackStore(str(tmp_path / '.store'))
+    view_dir = str(tmp_path / 'profile')
+    (tmp_path / 'profile').mkdir()
+    (tmp_path / 'profile' / 'song.mp3').write_bytes(mp3(1000))
+    object_path = store.object_path(1, 'mp3')
+    assert store.adopt(object_path, view_dir, 'song', 26122)
+    assert store.link(object_path, view_dir, 'song', 1) == f'{view_dir}/song.mp3'
+    assert sorted(p.name for p in (tmp_path / 'profile').iterdir()) == ['song.mp3']
+    # once linked it belongs to the store, another track of the same title gets its own file
+    assert not store.adopt(store.object_path(2, 'mp3'), view_dir, 'song', 26122)
+
+
+def test_files_of_another_duration_are_not_adopted(tmp_path):
+    store = TrackStore(str(tmp_path / '.store'))
+    view_dir = str(tmp_path / 'profile')
+    (tmp_path / 'profile').mkdir()
+    # cut short by a crash, or another track of the same title
+    (tmp_path / 'profile' / 'song.mp3').write_bytes(mp3(500) + b'\xff\xfb\x90\x00')
+    (tmp_path / 'profile' / 'noise.mp3').write_bytes(b'not an mp3')
+    assert not store.adopt(store.object_path(1, 'mp3'), view_dir, 'song', 26122)
+    assert not store.adopt(store.object_path(1, 'mp3'), view_dir, 'noise', 26122)
+    assert not store.has(1, 'mp3')
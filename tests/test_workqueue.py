@@ -0,0 +1,84 @@
+import asyncio
+import time
+
+from scloud_dl import Track
+from scloud_dl.workqueue import WorkQueue
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def queue(tmp_path, lanes=(), **kwargs) -> WorkQueue:
+    return WorkQueue(str(tmp_path / 'jobs.db'), lanes=lanes, poll_interval=0.01, **kwargs)
+
+
+def track(track_id: int, url: str = None) -> Track:
+    return Track(title=f'track {track_id}', url=url or f'https://cdn/{track_id}', id=track_id)
+
+
+def test_workers_lease_distinct_jobs(tmp_path):
+    coordinator = queue(tmp_path, lanes=['a'])
+    run(coordinator.put('a', track(1)))
+    run(coordinator.put('a', track(2)))
+    (first, second) = (queue(tmp_path), queue(tmp_path))
+    first.owner, second.owner = 'first', 'second'
+    (_, claimed) = run(first.get())
+    (_, other) = run(second.get())
+    assert {claimed.id, other.id} == {1, 2}
+    assert coordinator.qsize() == 0
+
+
+def test_expired_lease_is_handed_out_again_until_max_attempts(tmp_path):
+    coordinator = queue(tmp_path, lanes=['a'], lease_seconds=0, max_attempts=2)
+    run(coordinator.put('a', track(1)))
+    run(coordinator.close('a'))
+    (crashed, worker) = (queue(tmp_path, lease_seconds=0, max_attempts=2), queue(tmp_path, max_attempts=2))
+    crashed.owner, worker.owner = 'crashed', 'worker'
+    assert run(crashed.get())[1].id == 1
+    time.sleep(0.01)
+    scheduled = run(worker.get())
+    assert scheduled[1].id == 1
+    worker.task_done(scheduled, False)
+    # the second attempt was the last one, the job failed and the queue is finished
+    assert run(worker.get()) is None
+    assert worker._count('failed') == 1
+
+
+def test_settled_job_finishes_the_queue(tmp_path):
+    coordinator = queue(tmp_path, lanes=['a'])
+    run(coordinator.put('a', track(1)))
+    worker = queue(tmp_path)
+    scheduled = run(worker.get())
+    run(coordinator.close('a'))
+    assert not worker._finished()
+    worker.task_done(scheduled, True)
+    assert worker._finished()
+    assert run(worker.get()) is None
+
+
+def test_worker_waits_for_the_coordinator_of_a_reused_queue(tmp_path):
+    previous = queue(tmp_path, lanes=['a'])
+    run(previous.close('a'))
+    worker = queue(tmp_path)
+    # the lanes closed by the previous run do not end this one
+    assert not worker._finished()
+    coordinator = queue(tmp_path, lanes=['a'])
+    run(coordinator.put('a', track(1)))
+    run(coordinator.close('a'))
+    assert not worker._finished()
+    worker.task_done(run(worker.get()), True)
+    assert worker._finished()
+
+
+def test_put_refreshes_jobs_nobody_works_on(tmp_path):
+    coordinator = queue(tmp_path, lanes=['a'], lease_seconds=0)
+    run(coordinator.put('a', track(1, 'https://cdn/expired')))
+    run(coordinator.put('a', track(1, 'https://cdn/fresh')))
+    assert coordinator.qsize() == 1
+    worker = queue(tmp_path, lease_seconds=0)
+    assert run(worker.get())[1].url == 'https://cdn/fresh'
+    time.sleep(0.01)
+    # the lease expired, so the job takes the url of the next run
+    run(coordinator.put('a', track(1, 'https://cdn/renewed')))
+    assert run(queue(tmp_path).get())[1].url == 'https://cdn/renewed'